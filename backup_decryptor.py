@@ -4,6 +4,7 @@
 Работает независимо от основного проекта
 """
 
+import io
 import json
 import gzip
 import logging
@@ -19,12 +20,34 @@ from pathlib import Path
 try:
     from cryptography.fernet import Fernet
     from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
     from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 except ImportError:
     print("ERROR: cryptography library not found!")
     print("Install it with: pip install cryptography")
     sys.exit(1)
 
+# Новые бэкапы сжимаются zstd; gzip-бэкапы старых версий читаются без него
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Префикс токенов Fernet; токены старого формата дополнительно обернуты в base64
+FERNET_TOKEN_PREFIX = "gAAAAA"
+
+# Формат AES-GCM: base64(версия || nonce || шифротекст с тегом).
+# Версия 0x02 - ключ из PBKDF2, версия 0x03 - мастер-ключ используется напрямую
+AESGCM_TOKEN_VERSION = 0x02
+AESGCM_RAW_KEY_TOKEN_VERSION = 0x03
+AESGCM_NONCE_SIZE = 12
+
+# Префикс мастер-ключа, который бот использует без PBKDF2
+RAW_KEY_PREFIX = "raw:"
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -50,18 +73,50 @@ class StandaloneEncryptionService:
         if not master_key:
             raise ValueError("Master key is required for decryption")
         
-        self.fernet = self._create_fernet_key(master_key)
+        raw_mode = master_key.startswith(RAW_KEY_PREFIX)
+        if raw_mode:
+            master_key = master_key[len(RAW_KEY_PREFIX):]
+        
+        # Ключ PBKDF2 общий для Fernet (старые данные) и AES-GCM (новые данные)
+        derived_key = self._derive_key(master_key)
+        self.fernet = Fernet(base64.urlsafe_b64encode(derived_key))
+        self.aead = self._create_aead(derived_key)
+        
+        # Ключ с префиксом raw: бот использует без PBKDF2; старые версии бота
+        # так же использовали случайный ключ без префикса
+        raw_key = self._decode_raw_key(master_key)
+        if raw_mode and raw_key is None:
+            raise ValueError(f"Master key with '{RAW_KEY_PREFIX}' prefix must be 32 bytes in urlsafe base64")
+        self.raw_key_aead = self._create_aead(raw_key) if raw_key is not None else None
         logger.info("Encryption service initialized")
     
-    def _create_fernet_key(self, master_key: str) -> Fernet:
+    def _decode_raw_key(self, master_key: str) -> Optional[bytes]:
+        """
+        Строгое декодирование случайного 32-байтного ключа из urlsafe base64
+        
+        Args:
+            master_key: Мастер-ключ без префикса raw:
+            
+        Returns:
+            32 байта ключа или None, если строка не является таким ключом
+        """
+        if len(master_key) not in (43, 44):
+            return None
+        try:
+            raw_key = base64.b64decode(master_key + '=' * (-len(master_key) % 4), altchars=b'-_', validate=True)
+        except ValueError:
+            return None
+        return raw_key if len(raw_key) == 32 else None
+    
+    def _derive_key(self, master_key: str) -> bytes:
         """
-        Создание ключа Fernet из мастер-ключа
+        Получение 32-байтного ключа из мастер-ключа через PBKDF2
         
         Args:
             master_key: Мастер-ключ в виде строки
             
         Returns:
-            Объект Fernet для расшифровки
+            Производный ключ
         """
         # Используем ту же соль, что и в оригинале
         salt = b'salt_for_tg_planner_bot_2024'
@@ -72,15 +127,32 @@ class StandaloneEncryptionService:
             salt=salt,
             iterations=100000,
         )
-        key = base64.urlsafe_b64encode(kdf.derive(master_key.encode()))
-        return Fernet(key)
+        return kdf.derive(master_key.encode())
+    
+    def _create_aead(self, derived_key: bytes) -> AESGCM:
+        """
+        Создание шифра AES-256-GCM с тем же выводом ключа через HKDF, что и в боте
+        
+        Args:
+            derived_key: Ключ PBKDF2 или случайный мастер-ключ
+            
+        Returns:
+            Объект AESGCM для расшифровки
+        """
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'tg_planner_bot aes-256-gcm',
+        )
+        return AESGCM(hkdf.derive(derived_key))
     
     def decrypt(self, encrypted_data: str) -> str:
         """
         Расшифровка строки
         
         Args:
-            encrypted_data: Зашифрованная строка в base64
+            encrypted_data: Токен AES-GCM, токен Fernet или токен Fernet в двойном base64
             
         Returns:
             Расшифрованная строка
@@ -89,9 +161,21 @@ class StandaloneEncryptionService:
             return ""
         
         try:
-            decoded_data = base64.urlsafe_b64decode(encrypted_data.encode('utf-8'))
-            decrypted_data = self.fernet.decrypt(decoded_data)
-            return decrypted_data.decode('utf-8')
+            token = encrypted_data.encode('ascii')
+            if encrypted_data.startswith(FERNET_TOKEN_PREFIX):
+                # Токен Fernet без дополнительной обертки
+                return self.fernet.decrypt(token).decode('utf-8')
+            
+            raw = base64.urlsafe_b64decode(token)
+            if raw[0] in (AESGCM_TOKEN_VERSION, AESGCM_RAW_KEY_TOKEN_VERSION):
+                aead = self.aead if raw[0] == AESGCM_TOKEN_VERSION else self.raw_key_aead
+                if aead is None:
+                    raise ValueError("Token was encrypted with a raw master key, but the given key is not one")
+                nonce = raw[1:AESGCM_NONCE_SIZE + 1]
+                return aead.decrypt(nonce, raw[AESGCM_NONCE_SIZE + 1:], None).decode('utf-8')
+            
+            # Старый формат: токен Fernet, дополнительно обернутый в base64
+            return self.fernet.decrypt(raw).decode('utf-8')
         except Exception as e:
             logger.error(f"Decryption failed: {e}")
             raise
@@ -119,6 +203,12 @@ class StandaloneBackupDecryptor:
             logger.error(f"Failed to decrypt {item_type} {item_id}: {e}")
             return error_msg
     
+    def _get_zstd_decompressor(self):
+        """Создание zstd-декомпрессора для бэкапов .json.zst"""
+        if zstandard is None:
+            raise RuntimeError("zstandard library not found! Install it with: pip install zstandard")
+        return zstandard.ZstdDecompressor()
+    
     def load_backup_from_file(self, file_path: str) -> Dict[str, Any]:
         """Загрузка бэкапа из сжатого файла"""
         file_path = Path(file_path)
@@ -127,8 +217,15 @@ class StandaloneBackupDecryptor:
             raise FileNotFoundError(f"Backup file not found: {file_path}")
         
         try:
-            with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-                backup_data = json.load(f)
+            with open(file_path, 'rb') as raw_file:
+                is_zstd = raw_file.read(4) == ZSTD_MAGIC
+                raw_file.seek(0)
+                if is_zstd:
+                    reader = self._get_zstd_decompressor().stream_reader(raw_file)
+                    backup_data = json.load(io.TextIOWrapper(reader, encoding='utf-8'))
+                else:
+                    with gzip.open(raw_file, 'rt', encoding='utf-8') as f:
+                        backup_data = json.load(f)
             
             logger.info(f"Backup loaded from {file_path}")
             return backup_data
@@ -140,7 +237,10 @@ class StandaloneBackupDecryptor:
     def load_backup_from_bytes(self, compressed_data: bytes) -> Dict[str, Any]:
         """Загрузка бэкапа из сжатых байтов"""
         try:
-            decompressed_data = gzip.decompress(compressed_data)
+            if compressed_data.startswith(ZSTD_MAGIC):
+                decompressed_data = self._get_zstd_decompressor().decompressobj().decompress(compressed_data)
+            else:
+                decompressed_data = gzip.decompress(compressed_data)
             backup_data = json.loads(decompressed_data.decode('utf-8'))
             
             logger.info("Backup loaded from bytes")
@@ -320,7 +420,7 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Примеры использования:
-  %(prog)s backup.json.gz                          # Интерактивная расшифровка
+  %(prog)s backup.json.zst                         # Интерактивная расшифровка (.json.gz тоже поддерживается)
   %(prog)s backup.json.gz -k YOUR_KEY              # С указанием ключа
   %(prog)s backup.json.gz -o decrypted.json        # С указанием выходного файла
   %(prog)s backup.json.gz -k YOUR_KEY --summary    # Только показать сводку
@@ -329,7 +429,7 @@ def main():
     
     parser.add_argument(
         'input_file',
-        help='Путь к зашифрованному бэкапу (.json.gz)'
+        help='Путь к зашифрованному бэкапу (.json.zst или .json.gz)'
     )
     
     parser.add_argument(
@@ -425,6 +525,7 @@ if __name__ == "__main__":
 
 #Python 3.7+
 #cryptography==42.0.5
+#zstandard==0.22.0 (для бэкапов .json.zst)
 
 #how to use:
 
@@ -441,7 +542,7 @@ if __name__ == "__main__":
 
 # | Параметр | Описание |
 # |----------|----------|
-# | `input_file` | Путь к зашифрованному бэкапу (.json.gz) |
+# | `input_file` | Путь к зашифрованному бэкапу (.json.zst или .json.gz) |
 # | `-k, --key` | Ключ шифрования |
 # | `-o, --output` | Путь к выходному файлу (по умолчанию: decrypted_backup.json) |
 # | `--summary` | Показать только сводку по бэкапу |
@@ -1,5 +1,5 @@
 import asyncpg
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from config import DATABASE_URL
 import logging
 import asyncio
@@ -55,17 +55,37 @@ class Database:
     
     def _decrypt_items(self, items: List[Any], text_field: str, id_field: str, item_type: str) -> List[Dict[str, Any]]:
         """Универсальный метод для расшифровки списка элементов"""
+        from services.encryption_service import decrypt_texts, DECRYPTION_ERROR_TEXT
+        
+        # Расшифровываем все тексты одним пакетом
+        texts = decrypt_texts([item[text_field] for item in items], on_error=DECRYPTION_ERROR_TEXT)
+        
         decrypted_items = []
-        for item in items:
+        for item, text in zip(items, texts):
+            if text is DECRYPTION_ERROR_TEXT:
+                logger.error(f"Failed to decrypt {item_type} {item[id_field]}")
             item_dict = dict(item)
-            item_dict[text_field] = self._decrypt_text(
-                item[text_field], 
-                item[id_field], 
-                item_type
-            )
+            item_dict[text_field] = text
             decrypted_items.append(item_dict)
         return decrypted_items
 
+    # Одиночные запросы: соединение берется из пула только на время самого запроса
+    async def fetch(self, query: str, *args) -> List[asyncpg.Record]:
+        """Выполнение запроса с возвратом всех строк"""
+        return await self.pool.fetch(query, *args)
+    
+    async def fetchrow(self, query: str, *args) -> Optional[asyncpg.Record]:
+        """Выполнение запроса с возвратом первой строки"""
+        return await self.pool.fetchrow(query, *args)
+    
+    async def fetchval(self, query: str, *args) -> Any:
+        """Выполнение запроса с возвратом одного значения"""
+        return await self.pool.fetchval(query, *args)
+    
+    async def execute(self, query: str, *args) -> str:
+        """Выполнение запроса без возврата строк"""
+        return await self.pool.execute(query, *args)
+
     # НОВЫЙ МЕТОД: Безопасное выполнение операций с БД
     async def safe_execute(self, operation_func, max_retries=3, *args, **kwargs):
         """
@@ -173,7 +193,11 @@ class Database:
             "CREATE INDEX IF NOT EXISTS idx_tasks_user_status ON tasks(user_id, status)",
             "CREATE INDEX IF NOT EXISTS idx_tasks_deadline ON tasks(deadline) WHERE deadline IS NOT NULL",
             "CREATE INDEX IF NOT EXISTS idx_task_categories_user ON task_categories(user_id, created_at DESC)",
-            "CREATE INDEX IF NOT EXISTS idx_diary_entries_user_date ON diary_entries(user_id, entry_date DESC)"
+            "CREATE INDEX IF NOT EXISTS idx_diary_entries_user_date ON diary_entries(user_id, entry_date DESC)",
+            # Рассылки по часовым поясам: выборка пользователей пояса без чтения всей таблицы
+            "CREATE INDEX IF NOT EXISTS idx_users_timezone ON users(timezone, user_id)",
+            # Очистка категорий: проверка NOT EXISTS по задачам категории
+            "CREATE INDEX IF NOT EXISTS idx_tasks_user_category ON tasks(user_id, category) WHERE category IS NOT NULL"
         ]
         
         # ИСПРАВЛЕНИЕ: Используем отдельные соединения для создания таблиц
@@ -215,7 +239,34 @@ class Database:
             return self._decrypt_items(tasks, 'text', 'task_id', 'task')
         
         return await self.safe_execute(_get_tasks)
-    
+
+    async def get_user_tasks_for_display(self, user_id: int, status: str) -> List[Dict[str, Any]]:
+        """Получение задач пользователя с датами, уже отформатированными в его часовом поясе"""
+        async def _get_tasks_for_display():
+            async with self.pool.acquire() as conn:
+                tasks = await conn.fetch(
+                    """SELECT t.task_id, t.text, t.category, t.deadline, t.status, t.created_at,
+                              t.completed_at, t.marked_overdue_at,
+                              -- Дата для отображения уже в часовом поясе пользователя
+                              to_char(
+                                  CASE WHEN t.status IN ('completed', 'failed') THEN t.completed_at ELSE t.deadline END
+                                      AT TIME ZONE 'UTC' AT TIME ZONE u.timezone,
+                                  'DD.MM.YYYY'
+                              ) AS display_date,
+                              (t.status = 'active'
+                               AND (t.deadline AT TIME ZONE 'UTC' AT TIME ZONE u.timezone)::date
+                                   = (NOW() AT TIME ZONE u.timezone)::date) AS due_today
+                       FROM tasks t
+                       JOIN users u ON u.user_id = t.user_id
+                       WHERE t.user_id = $1 AND t.status = $2
+                       ORDER BY t.created_at DESC""",
+                    user_id, status
+                )
+
+            return self._decrypt_items(tasks, 'text', 'task_id', 'task')
+
+        return await self.safe_execute(_get_tasks_for_display)
+
     async def update_task_status(self, task_id: int, user_id: int, status: str) -> bool:
         """Обновление статуса задачи"""
         async def _update_status():
@@ -262,6 +313,63 @@ class Database:
         
         return await self.safe_execute(_delete_task)
     
+    async def mark_overdue_tasks(self, overdue_limit: int, user_id: Optional[int] = None) -> Tuple[int, List[int]]:
+        """
+        Пометка просроченных задач с удалением самых старых просроченных сверх лимита
+        
+        Args:
+            overdue_limit: Максимальное количество просроченных задач у пользователя
+            user_id: Пользователь, для которого выполняется проверка (None - все пользователи)
+            
+        Returns:
+            Количество помеченных задач и id пользователей, у которых были удалены задачи
+        """
+        async def _mark_overdue():
+            async with self.pool.acquire() as conn:
+                # Один запрос: новые просроченные задачи ранжируются вместе с уже просроченными,
+                # лишние сверх лимита удаляются, остальные новые помечаются как просроченные.
+                # Дедлайны хранятся в UTC, поэтому часовой пояс пользователя не нужен
+                result = await conn.fetchrow(
+                    """WITH marked AS (
+                        SELECT task_id, user_id FROM tasks
+                        WHERE status = 'active' AND deadline IS NOT NULL
+                        AND deadline < (NOW() AT TIME ZONE 'UTC')
+                        AND ($1::bigint IS NULL OR user_id = $1)
+                        FOR UPDATE
+                    ),
+                    excess AS (
+                        SELECT task_id FROM (
+                            SELECT task_id, ROW_NUMBER() OVER (
+                                PARTITION BY user_id
+                                ORDER BY marked_at DESC, task_id DESC
+                            ) AS rn
+                            FROM (
+                                SELECT task_id, user_id, NOW()::timestamp AS marked_at FROM marked
+                                UNION ALL
+                                SELECT task_id, user_id, marked_overdue_at FROM tasks
+                                WHERE status = 'overdue' AND user_id IN (SELECT user_id FROM marked)
+                            ) candidates
+                        ) ranked
+                        WHERE rn > $2
+                    ),
+                    deleted AS (
+                        DELETE FROM tasks WHERE task_id IN (SELECT task_id FROM excess)
+                        RETURNING user_id
+                    ),
+                    updated AS (
+                        UPDATE tasks SET status = 'overdue', marked_overdue_at = NOW()
+                        WHERE task_id IN (SELECT task_id FROM marked)
+                        AND task_id NOT IN (SELECT task_id FROM excess)
+                    )
+                    SELECT (SELECT COUNT(*) FROM marked) AS marked_count,
+                           ARRAY(SELECT DISTINCT user_id FROM deleted) AS trimmed_user_ids""",
+                    user_id, overdue_limit
+                )
+                
+                return result['marked_count'], list(result['trimmed_user_ids'])
+        
+        return await self.safe_execute(_mark_overdue)
+    
     # === МЕТОДЫ ДЛЯ РАБОТЫ С НАПОМИНАНИЯМИ ===
     
     async def create_reminder(self, user_id: int, text: str, reminder_type: str, 
@@ -465,6 +573,33 @@ class Database:
         
         return await self.safe_execute(_create_category)
     
+    async def delete_unused_categories(self, user_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """
+        Удаление категорий, которые не используются ни в одной задаче
+        
+        Args:
+            user_ids: Пользователи, у которых выполняется очистка (None - все пользователи)
+            
+        Returns:
+            Удаленные категории (user_id, name)
+        """
+        async def _delete_unused():
+            async with self.pool.acquire() as conn:
+                deleted = await conn.fetch(
+                    """DELETE FROM task_categories tc
+                       WHERE ($1::bigint[] IS NULL OR tc.user_id = ANY($1::bigint[]))
+                       AND NOT EXISTS (
+                           SELECT 1 FROM tasks t
+                           WHERE t.user_id = tc.user_id AND t.category = tc.name
+                       )
+                       RETURNING tc.user_id, tc.name""",
+                    user_ids
+                )
+            
+            return [dict(category) for category in deleted]
+        
+        return await self.safe_execute(_delete_unused)
+    
     # === МИГРАЦИЯ СУЩЕСТВУЮЩИХ ДАННЫХ ===
     
     async def _migrate_table_data(self, conn, table: str, id_field: str, text_field: str):
@@ -607,7 +607,7 @@ async def handle_reminder_action(callback: types.CallbackQuery, state: FSMContex
                     # Для повторяющихся напоминаний используем правильный метод
                     await scheduler.add_recurring_reminder_with_timezone(
                         reminder_id, user_id, reminder['text'], 
-                        reminder['cron_expression'], user['timezone']
+                        reminder['cron_expression'], user['timezone'], reminder['is_built_in']
                     )
             
             await callback.answer("Напоминание включено")
@@ -7,7 +7,7 @@ import logging
 
 from database.connection import db
 from keyboards.keyboards import get_timezone_keyboard, get_main_menu_keyboard
-from services.timezone_service import get_timezone_from_location
+from services.timezone_service import get_timezone_from_location, get_zoneinfo
 
 logger = logging.getLogger(__name__)
 
@@ -50,9 +50,8 @@ async def timezone_selected(callback: types.CallbackQuery, state: FSMContext):
     
     # Получаем текущее время в выбранном часовом поясе
     from datetime import datetime
-    import pytz
     
-    tz = pytz.timezone(timezone)
+    tz = get_zoneinfo(timezone)
     current_time = datetime.now(tz).strftime("%H:%M")
     current_date = datetime.now(tz).strftime("%d.%m.%Y")
     
@@ -72,6 +71,8 @@ async def timezone_selected(callback: types.CallbackQuery, state: FSMContext):
     if is_new_user:
         await add_built_in_reminders(user_id)
     
+    await sync_user_scheduler_jobs(user_id, timezone)
+    
     await callback.message.edit_text(
         f"✅ Часовой пояс установлен: {timezone}\n"
         f"🕐 Текущее время: {current_time}\n"
@@ -108,14 +109,13 @@ async def location_received(message: types.Message, state: FSMContext):
     
     try:
         # Определяем часовой пояс по координатам
-        timezone = await get_timezone_from_location(location.latitude, location.longitude)
+        timezone = get_timezone_from_location(location.latitude, location.longitude)
         
         if timezone:
             # Получаем текущее время в этом часовом поясе
             from datetime import datetime
-            import pytz
             
-            tz = pytz.timezone(timezone)
+            tz = get_zoneinfo(timezone)
             current_time = datetime.now(tz).strftime("%H:%M")
             current_date = datetime.now(tz).strftime("%d.%m.%Y")
             
@@ -135,6 +135,8 @@ async def location_received(message: types.Message, state: FSMContext):
             if is_new_user:
                 await add_built_in_reminders(user_id)
             
+            await sync_user_scheduler_jobs(user_id, timezone)
+            
             await message.answer(
                 f"✅ Часовой пояс определен: {timezone}\n"
                 f"🕐 Текущее время: {current_time}\n"
@@ -159,6 +161,14 @@ async def location_received(message: types.Message, state: FSMContext):
             reply_markup=get_timezone_keyboard()
         )
 
+async def sync_user_scheduler_jobs(user_id: int, timezone: str):
+    """Подключает пользователя к рассылкам часового пояса и пересоздает задачи его напоминаний"""
+    from services.scheduler_service import get_scheduler
+    
+    scheduler = get_scheduler()
+    if scheduler:
+        await scheduler.update_user_system_tasks(user_id, timezone)
+
 async def add_built_in_reminders(user_id: int):
     """Добавляет встроенные напоминания для нового пользователя с использованием шифрования"""
     reminder_text = "Умное ежедневное напоминание о подведении итогов"
@@ -1,8 +1,11 @@
-from aiogram import Router, types
+from aiogram import F, Router, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from datetime import datetime, timedelta
-import pytz
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import asyncio
 import logging
 
 from database.connection import db
@@ -10,7 +13,7 @@ from keyboards.keyboards import (
     get_tasks_menu_keyboard, get_back_to_main_keyboard, get_task_view_menu_keyboard,
     get_category_selection_keyboard, get_deadline_selection_keyboard
 )
-from services.timezone_service import get_user_time
+from services.timezone_service import get_timezone, get_user_time
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -23,6 +26,29 @@ TASK_LIMITS = {
     'overdue': 25
 }
 
+# Окно, в течение которого серия нажатий в одном списке задач сводится к одному обновлению сообщения
+REFRESH_DEBOUNCE_SECONDS = 0.3
+
+# Последнее запланированное обновление списка задач: (chat_id, message_id) -> asyncio.Task
+_pending_refreshes = {}
+
+# Сильные ссылки на все задачи обновления, чтобы их не собрал сборщик мусора
+_refresh_tasks = set()
+
+# Обновления, которые уже редактируют сообщение и не отменяются новыми нажатиями
+_started_refreshes = set()
+
+# Блокировки по сообщениям, чтобы правки одного сообщения не пересекались
+_refresh_locks = {}
+
+# Заголовки списков задач по статусу
+TASK_STATUS_TITLES = {
+    'active': "🔥 Активные задачи",
+    'completed': "✅ Выполненные задачи",
+    'failed': "❌ Невыполненные задачи",
+    'overdue': "⚠️ Просроченные задачи"
+}
+
 class TaskStates(StatesGroup):
     waiting_for_text = State()
     waiting_for_category = State()
@@ -31,6 +57,12 @@ class TaskStates(StatesGroup):
     waiting_for_custom_deadline = State()
     waiting_for_extend_deadline = State()
 
+class TaskGroupAction(CallbackData, prefix="group"):
+    """Callback-данные кнопок управления задачами в списке"""
+    action: str  # complete, fail, delete или extend
+    task_id: int
+    status: str  # статус списка, из которого нажата кнопка
+
 # ======= HELPER FUNCTIONS =======
 
 def normalize_datetime_for_db(dt):
@@ -41,7 +73,7 @@ def normalize_datetime_for_db(dt):
     # Если datetime содержит timezone info, конвертируем в UTC и убираем timezone info
     if dt.tzinfo is not None:
         # Конвертируем в UTC и делаем naive
-        utc_dt = dt.astimezone(pytz.UTC)
+        utc_dt = dt.astimezone(timezone.utc)
         return utc_dt.replace(tzinfo=None)
     
     # Если уже naive, возвращаем как есть
@@ -50,11 +82,11 @@ def normalize_datetime_for_db(dt):
 def create_deadline_from_user_time(user_timezone_str, year, month, day, hour=23, minute=59, second=59):
     """Создает deadline с учетом часового пояса пользователя"""
     try:
-        user_tz = pytz.timezone(user_timezone_str)
+        user_tz = get_timezone(user_timezone_str)
         # Создаем naive datetime
         naive_dt = datetime(year, month, day, hour, minute, second)
-        # Локализуем в часовой пояс пользователя
-        localized_dt = user_tz.localize(naive_dt)
+        # Привязываем к часовому поясу пользователя
+        localized_dt = naive_dt.replace(tzinfo=user_tz)
         # Нормализуем для БД
         return normalize_datetime_for_db(localized_dt)
     except Exception as e:
@@ -129,7 +161,8 @@ async def send_message_with_fallback(message_or_callback, text, reply_markup=Non
     if is_callback and hasattr(message_or_callback, 'message') and hasattr(message_or_callback.message, 'edit_text'):
         try:
             await message_or_callback.message.edit_text(text, reply_markup=reply_markup)
-        except:
+        except TelegramBadRequest:
+            # Сообщение нельзя отредактировать - отправляем новое
             await message_or_callback.message.answer(text, reply_markup=reply_markup)
     else:
         target = message_or_callback.message if is_callback else message_or_callback
@@ -138,26 +171,11 @@ async def send_message_with_fallback(message_or_callback, text, reply_markup=Non
 async def cleanup_unused_categories(user_id: int):
     """Удаляет неиспользуемые категории задач для пользователя"""
     try:
-        async with db.pool.acquire() as conn:
-            # Находим категории, которые не используются ни в одной задаче
-            unused_categories = await conn.fetch(
-                """SELECT tc.category_id, tc.name 
-                   FROM task_categories tc
-                   LEFT JOIN tasks t ON tc.name = t.category AND tc.user_id = t.user_id
-                   WHERE tc.user_id = $1 AND t.task_id IS NULL""",
-                user_id
-            )
-            
-            if unused_categories:
-                # Удаляем неиспользуемые категории
-                category_ids = [cat['category_id'] for cat in unused_categories]
-                await conn.execute(
-                    "DELETE FROM task_categories WHERE category_id = ANY($1::int[])",
-                    category_ids
-                )
-                
-                category_names = [cat['name'] for cat in unused_categories]
-                logger.info(f"Cleaned up {len(category_ids)} unused categories for user {user_id}: {category_names}")
+        deleted = await db.delete_unused_categories([user_id])
+        
+        if deleted:
+            category_names = [cat['name'] for cat in deleted]
+            logger.info(f"Cleaned up {len(deleted)} unused categories for user {user_id}: {category_names}")
                 
     except Exception as e:
         logger.error(f"Error cleaning up unused categories for user {user_id}: {e}")
@@ -495,7 +513,7 @@ async def save_task(callback_or_message, state, deadline, is_from_message=False)
             async with db.pool.acquire() as conn:
                 user = await conn.fetchrow("SELECT timezone FROM users WHERE user_id = $1", user_id)
             
-            display_deadline = pytz.UTC.localize(normalized_deadline).astimezone(pytz.timezone(user['timezone']))
+            display_deadline = normalized_deadline.replace(tzinfo=timezone.utc).astimezone(get_timezone(user['timezone']))
             deadline_text = display_deadline.strftime('%d.%m.%Y')
         else:
             deadline_text = "без дедлайна"
@@ -535,6 +553,23 @@ def create_tasks_keyboard(tasks_data, status):
     """Создает клавиатуру для управления задачами с номерами"""
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     
+    # Дополнительные кнопки в зависимости от статуса (кнопка удаления есть всегда)
+    actions_by_status = {
+        'active': [("✅", "complete"), ("❌", "fail")],
+        'overdue': [("⏰", "extend"), ("✅", "complete"), ("❌", "fail")]
+    }
+    row_actions = [("🗑", "delete")] + actions_by_status.get(status, [])
+    
+    def task_row(task_id, counter):
+        """Строка кнопок для задачи с правильным номером"""
+        return [
+            InlineKeyboardButton(
+                text=f"{icon}#{counter}",
+                callback_data=TaskGroupAction(action=action, task_id=task_id, status=status).pack()
+            )
+            for icon, action in row_actions
+        ]
+    
     keyboard = []
     
     # ВАЖНО: Используем ту же логику группировки, что и в format_tasks_message
@@ -554,86 +589,19 @@ def create_tasks_keyboard(tasks_data, status):
     # Обрабатываем задачи в том же порядке, что и в format_tasks_message
     # Сначала категоризированные задачи
     for category_name in sorted(categorized_tasks.keys()):  # Сортируем для стабильности
-        category_tasks = categorized_tasks[category_name]
-        for task in category_tasks:
-            row = []
-            task_id = task['task_id']
-            
-            # Кнопка удаления с правильным номером
-            row.append(InlineKeyboardButton(
-                text=f"🗑#{task_counter}",
-                callback_data=f"group_delete_{task_id}_{status}"
-            ))
-            
-            # Дополнительные кнопки в зависимости от статуса
-            if status == 'active':
-                row.append(InlineKeyboardButton(
-                    text=f"✅#{task_counter}",
-                    callback_data=f"group_complete_{task_id}_{status}"
-                ))
-                row.append(InlineKeyboardButton(
-                    text=f"❌#{task_counter}",
-                    callback_data=f"group_fail_{task_id}_{status}"
-                ))
-            elif status == 'overdue':
-                row.append(InlineKeyboardButton(
-                    text=f"⏰#{task_counter}",
-                    callback_data=f"group_extend_{task_id}_{status}"
-                ))
-                row.append(InlineKeyboardButton(
-                    text=f"✅#{task_counter}",
-                    callback_data=f"group_complete_{task_id}_{status}"
-                ))
-                row.append(InlineKeyboardButton(
-                    text=f"❌#{task_counter}",
-                    callback_data=f"group_fail_{task_id}_{status}"
-                ))
-            
-            keyboard.append(row)
+        for task in categorized_tasks[category_name]:
+            keyboard.append(task_row(task['task_id'], task_counter))
             task_counter += 1
     
     # Потом задачи без категории
     for task in uncategorized_tasks:
-        row = []
-        task_id = task['task_id']
-        
-        # Кнопка удаления с правильным номером
-        row.append(InlineKeyboardButton(
-            text=f"🗑#{task_counter}",
-            callback_data=f"group_delete_{task_id}_{status}"
-        ))
-        
-        # Дополнительные кнопки в зависимости от статуса
-        if status == 'active':
-            row.append(InlineKeyboardButton(
-                text=f"✅#{task_counter}",
-                callback_data=f"group_complete_{task_id}_{status}"
-            ))
-            row.append(InlineKeyboardButton(
-                text=f"❌#{task_counter}",
-                callback_data=f"group_fail_{task_id}_{status}"
-            ))
-        elif status == 'overdue':
-            row.append(InlineKeyboardButton(
-                text=f"⏰#{task_counter}",
-                callback_data=f"group_extend_{task_id}_{status}"
-            ))
-            row.append(InlineKeyboardButton(
-                text=f"✅#{task_counter}",
-                callback_data=f"group_complete_{task_id}_{status}"
-            ))
-            row.append(InlineKeyboardButton(
-                text=f"❌#{task_counter}",
-                callback_data=f"group_fail_{task_id}_{status}"
-            ))
-        
-        keyboard.append(row)
+        keyboard.append(task_row(task['task_id'], task_counter))
         task_counter += 1
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
-def format_tasks_message(tasks_data, title, user_timezone=None):
+def format_tasks_message(tasks_data, title):
     """Форматирует сообщение со списком задач"""
     if not tasks_data:
         return f"{title}\n\nЗадач не найдено"
@@ -654,52 +622,12 @@ def format_tasks_message(tasks_data, title, user_timezone=None):
     
     task_counter = 1
     
-    # Получаем текущую дату в часовом поясе пользователя для выделения задач на сегодня
-    current_date = None
-    if user_timezone:
-        current_time = get_user_time(user_timezone)
-        current_date = current_time.date()
-    
     def format_task_line(task, counter):
         """Форматирует строку задачи"""
-        deadline_text = ""
-        task_prefix = ""
-        
-        task_status = task.get('status')
-        
-        if task_status == 'active':
-            # Для активных задач показываем дедлайн (если есть)
-            if task.get('deadline'):
-                # Конвертируем deadline в пользовательский часовой пояс
-                if user_timezone:
-                    deadline_display = pytz.UTC.localize(task['deadline']).astimezone(pytz.timezone(user_timezone))
-                    deadline_date = deadline_display.date()
-                    
-                    # Выделяем задачи на сегодня
-                    if current_date and deadline_date == current_date:
-                        task_prefix = "🚨 "
-                    
-                    deadline_text = f" (📅 {deadline_display.strftime('%d.%m.%Y')})"
-                else:
-                    deadline_text = f" (📅 {task['deadline'].strftime('%d.%m.%Y')})"
-        
-        elif task_status in ['completed', 'failed']:
-            # Для выполненных и невыполненных задач показываем дату завершения
-            if task.get('completed_at'):
-                if user_timezone:
-                    completed_display = pytz.UTC.localize(task['completed_at']).astimezone(pytz.timezone(user_timezone))
-                    deadline_text = f" (📅 {completed_display.strftime('%d.%m.%Y')})"
-                else:
-                    deadline_text = f" (📅 {task['completed_at'].strftime('%d.%m.%Y')})"
-        
-        elif task_status == 'overdue':
-            # Для просроченных задач показываем дедлайн (который был пропущен)
-            if task.get('deadline'):
-                if user_timezone:
-                    deadline_display = pytz.UTC.localize(task['deadline']).astimezone(pytz.timezone(user_timezone))
-                    deadline_text = f" (📅 {deadline_display.strftime('%d.%m.%Y')})"
-                else:
-                    deadline_text = f" (📅 {task['deadline'].strftime('%d.%m.%Y')})"
+        # Даты уже переведены в часовой пояс пользователя и отформатированы в SQL:
+        # дедлайн для активных и просроченных задач, дата завершения для остальных
+        task_prefix = "🚨 " if task.get('due_today') else ""
+        deadline_text = f" (📅 {task['display_date']})" if task.get('display_date') else ""
         
         return f"{counter}. {task_prefix}{task['text']}{deadline_text}"
     
@@ -731,20 +659,15 @@ async def send_tasks_group_message(message: types.Message, status: str, title: s
     """Отправляет сообщение с группой задач и кнопками управления"""
     user_id = message.from_user.id
     
-    async with db.pool.acquire() as conn:
-        # Получаем часовой пояс пользователя
-        user = await conn.fetchrow("SELECT timezone FROM users WHERE user_id = $1", user_id)
-        user_timezone = user['timezone'] if user else None
-    
-    # Получаем задачи (уже расшифрованные из db)
-    tasks = await db.get_user_tasks(user_id, status)
+    # Получаем задачи (уже расшифрованные из db) с датами в часовом поясе пользователя
+    tasks = await db.get_user_tasks_for_display(user_id, status)
     
     if not tasks:
         await message.answer(f"{title}\n\nЗадач не найдено")
         return
     
-    # Форматируем сообщение с учетом часового пояса
-    message_text = format_tasks_message(tasks, title, user_timezone)
+    # Форматируем сообщение
+    message_text = format_tasks_message(tasks, title)
     
     # Создаем клавиатуру
     keyboard = create_tasks_keyboard(tasks, status)
@@ -757,53 +680,9 @@ async def send_tasks_group_message(message: types.Message, status: str, title: s
 async def update_overdue_tasks_for_user(user_id: int):
     """Обновление просроченных задач для конкретного пользователя"""
     try:
-        async with db.pool.acquire() as conn:
-            # Получаем часовой пояс пользователя
-            user = await conn.fetchrow("SELECT timezone FROM users WHERE user_id = $1", user_id)
-            if not user:
-                return
-            
-            current_time = get_user_time(user['timezone'])
-            current_utc = normalize_datetime_for_db(current_time)
-            
-            # Находим задачи, которые должны стать просроченными
-            overdue_tasks = await conn.fetch(
-                """SELECT task_id FROM tasks 
-                   WHERE user_id = $1 AND status = 'active' 
-                   AND deadline IS NOT NULL AND deadline < $2""",
-                user_id, current_utc
-            )
-            
-            if overdue_tasks:
-                # Проверяем лимит просроченных задач
-                overdue_count = await conn.fetchval(
-                    "SELECT COUNT(*) FROM tasks WHERE user_id = $1 AND status = 'overdue'",
-                    user_id
-                )
-                
-                tasks_to_mark = len(overdue_tasks)
-                
-                # Если превышаем лимит, удаляем самые старые просроченные
-                if overdue_count + tasks_to_mark > TASK_LIMITS['overdue']:
-                    delete_count = (overdue_count + tasks_to_mark) - TASK_LIMITS['overdue']
-                    await conn.execute(
-                        """DELETE FROM tasks WHERE task_id IN (
-                            SELECT task_id FROM tasks 
-                            WHERE user_id = $1 AND status = 'overdue'
-                            ORDER BY marked_overdue_at ASC LIMIT $2
-                        )""",
-                        user_id, delete_count
-                    )
-                
-                # Помечаем задачи как просроченные
-                task_ids = [task['task_id'] for task in overdue_tasks]
-                await conn.execute(
-                    """UPDATE tasks SET status = 'overdue', marked_overdue_at = NOW() 
-                       WHERE task_id = ANY($1::int[])""",
-                    task_ids
-                )
-                
-                logger.info(f"Auto-marked {len(task_ids)} tasks as overdue for user {user_id}")
+        marked_count, _ = await db.mark_overdue_tasks(TASK_LIMITS['overdue'], user_id)
+        if marked_count:
+            logger.info(f"Auto-marked {marked_count} tasks as overdue for user {user_id}")
     
     except Exception as e:
         logger.error(f"Error updating overdue tasks for user {user_id}: {e}")
@@ -830,10 +709,10 @@ async def view_tasks_menu(message: types.Message, state: FSMContext):
 
 # Обработчики просмотра задач
 TASK_VIEW_HANDLERS = {
-    "🔥 Активные": ("active", "🔥 Активные задачи"),
-    "✅ Выполненные": ("completed", "✅ Выполненные задачи"),
-    "❌ Невыполненные": ("failed", "❌ Невыполненные задачи"),
-    "⚠️ Просроченные": ("overdue", "⚠️ Просроченные задачи")
+    "🔥 Активные": ("active", TASK_STATUS_TITLES['active']),
+    "✅ Выполненные": ("completed", TASK_STATUS_TITLES['completed']),
+    "❌ Невыполненные": ("failed", TASK_STATUS_TITLES['failed']),
+    "⚠️ Просроченные": ("overdue", TASK_STATUS_TITLES['overdue'])
 }
 
 async def handle_task_view(message: types.Message, status: str, title: str, update_overdue: bool = False):
@@ -851,11 +730,11 @@ async def view_tasks_handler(message: types.Message):
 
 # ======= ОБРАБОТЧИКИ ГРУППОВЫХ ДЕЙСТВИЙ =======
 
-async def handle_group_action(callback: types.CallbackQuery, action: str):
+async def handle_group_action(callback: types.CallbackQuery, callback_data: TaskGroupAction):
     """Универсальный обработчик групповых действий с задачами"""
-    parts = callback.data.split("_")
-    task_id = int(parts[2])
-    current_status = parts[3]
+    action = callback_data.action
+    task_id = callback_data.task_id
+    current_status = callback_data.status
     user_id = callback.from_user.id
     
     success = False
@@ -884,21 +763,19 @@ async def handle_group_action(callback: types.CallbackQuery, action: str):
     
     await callback.answer(message)
     
-    # Обновляем сообщение со списком задач
-    await refresh_tasks_message(callback, current_status, user_id)
+    # Обновляем сообщение со списком задач (серия быстрых нажатий дает одно обновление)
+    schedule_tasks_message_refresh(callback, current_status, user_id)
 
-@router.callback_query(lambda c: c.data.startswith(("group_complete_", "group_fail_", "group_delete_")))
-async def group_action_handler(callback: types.CallbackQuery):
+@router.callback_query(TaskGroupAction.filter(F.action.in_({"complete", "fail", "delete"})))
+async def group_action_handler(callback: types.CallbackQuery, callback_data: TaskGroupAction):
     """Универсальный обработчик для complete, fail, delete"""
-    action = callback.data.split("_")[1]  # complete, fail, или delete
-    await handle_group_action(callback, action)
+    await handle_group_action(callback, callback_data)
 
-@router.callback_query(lambda c: c.data.startswith("group_extend_"))
-async def group_extend_task(callback: types.CallbackQuery, state: FSMContext):
+@router.callback_query(TaskGroupAction.filter(F.action == "extend"))
+async def group_extend_task(callback: types.CallbackQuery, callback_data: TaskGroupAction, state: FSMContext):
     """Продлить просроченную задачу в групповом режиме"""
-    parts = callback.data.split("_")
-    task_id = int(parts[2])
-    current_status = parts[3]
+    task_id = callback_data.task_id
+    current_status = callback_data.status
     
     await state.update_data(extending_task_id=task_id, current_status=current_status)
     
@@ -912,41 +789,72 @@ async def group_extend_task(callback: types.CallbackQuery, state: FSMContext):
     )
     await state.set_state(TaskStates.waiting_for_extend_deadline)
 
+def is_message_unchanged(message: types.Message, text: str, reply_markup=None) -> bool:
+    """Проверяет, совпадает ли текущее сообщение с новым текстом и клавиатурой"""
+    # Telegram обрезает пробельные символы по краям текста сообщения
+    return message.text == text.strip() and message.reply_markup == reply_markup
+
+def schedule_tasks_message_refresh(callback: types.CallbackQuery, status: str, user_id: int):
+    """Откладывает обновление списка задач, отменяя еще не начатое обновление того же сообщения"""
+    key = (callback.message.chat.id, callback.message.message_id)
+    pending = _pending_refreshes.get(key)
+    if pending is not None and pending not in _started_refreshes:
+        pending.cancel()
+    
+    lock = _refresh_locks.setdefault(key, asyncio.Lock())
+    task = asyncio.create_task(_debounced_refresh(lock, callback, status, user_id))
+    _pending_refreshes[key] = task
+    _refresh_tasks.add(task)
+    task.add_done_callback(partial(_on_refresh_done, key))
+
+def _on_refresh_done(key, task: asyncio.Task):
+    """Освобождает ссылки на завершенное обновление"""
+    _refresh_tasks.discard(task)
+    _started_refreshes.discard(task)
+    # Запись сообщения убирается, только если после этой задачи новых не планировалось
+    if _pending_refreshes.get(key) is task:
+        del _pending_refreshes[key]
+        _refresh_locks.pop(key, None)
+
+async def _debounced_refresh(lock: asyncio.Lock, callback: types.CallbackQuery, status: str, user_id: int):
+    """Обновляет список задач, если за время ожидания не пришло новых нажатий"""
+    await asyncio.sleep(REFRESH_DEBOUNCE_SECONDS)
+    # Начатое обновление дожидается завершения предыдущего и больше не отменяется
+    async with lock:
+        _started_refreshes.add(asyncio.current_task())
+        try:
+            await refresh_tasks_message(callback, status, user_id)
+        except Exception as e:
+            logger.error(f"Error refreshing tasks message: {e}")
+
 async def refresh_tasks_message(callback: types.CallbackQuery, status: str, user_id: int):
     """Обновляет сообщение со списком задач после изменения"""
     
-    # Определяем заголовок в зависимости от статуса
-    titles = {
-        'active': "🔥 Активные задачи",
-        'completed': "✅ Выполненные задачи",
-        'failed': "❌ Невыполненные задачи",
-        'overdue': "⚠️ Просроченные задачи"
-    }
-    
-    title = titles.get(status, "Задачи")
-    
-    async with db.pool.acquire() as conn:
-        # Получаем часовой пояс пользователя
-        user = await conn.fetchrow("SELECT timezone FROM users WHERE user_id = $1", user_id)
-        user_timezone = user['timezone'] if user else None
+    title = TASK_STATUS_TITLES.get(status, "Задачи")
     
-    # Получаем обновленные задачи (уже расшифрованные)
-    tasks = await db.get_user_tasks(user_id, status)
+    # Получаем обновленные задачи (уже расшифрованные) с датами в часовом поясе пользователя
+    tasks = await db.get_user_tasks_for_display(user_id, status)
     
     # Если задач больше нет, показываем пустое сообщение
     if not tasks:
         try:
             await callback.message.edit_text(f"{title}\n\nЗадач не найдено")
-        except:
-            pass
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                logger.debug(f"Could not update empty tasks message: {e}")
         return
     
-    # Форматируем сообщение с учетом часового пояса
-    message_text = format_tasks_message(tasks, title, user_timezone)
+    # Форматируем сообщение
+    message_text = format_tasks_message(tasks, title)
     
     # Создаем клавиатуру
     keyboard = create_tasks_keyboard(tasks, status)
     
+    # Не вызываем edit_text, если содержимое не изменилось (например, повторное нажатие):
+    # Telegram все равно ответит "message is not modified", потратив запрос к API
+    if is_message_unchanged(callback.message, message_text, keyboard):
+        return
+    
     # Обновляем сообщение
     try:
         await callback.message.edit_text(message_text, reply_markup=keyboard)
@@ -965,17 +873,22 @@ async def complete_extend_task(callback, state: FSMContext, new_deadline):
     normalized_deadline = normalize_datetime_for_db(new_deadline)
     
     async with db.pool.acquire() as conn:
-        await conn.execute(
-            """UPDATE tasks SET status = 'active', deadline = $1, marked_overdue_at = NULL
-               WHERE task_id = $2 AND user_id = $3""",
+        # Обновляем задачу и сразу получаем часовой пояс для отображения
+        user_timezone = await conn.fetchval(
+            """UPDATE tasks t SET status = 'active', deadline = $1, marked_overdue_at = NULL
+               FROM users u
+               WHERE t.task_id = $2 AND t.user_id = $3 AND u.user_id = t.user_id
+               RETURNING u.timezone""",
             normalized_deadline, task_id, user_id
         )
-        
-        # Получаем часовой пояс для отображения
-        user = await conn.fetchrow("SELECT timezone FROM users WHERE user_id = $1", user_id)
+    
+    if user_timezone is None:
+        await callback.message.answer("❌ Задача не найдена", reply_markup=get_tasks_menu_keyboard())
+        await state.clear()
+        return
     
     if new_deadline:
-        display_deadline = pytz.UTC.localize(normalized_deadline).astimezone(pytz.timezone(user['timezone']))
+        display_deadline = normalized_deadline.replace(tzinfo=timezone.utc).astimezone(get_timezone(user_timezone))
         deadline_text = display_deadline.strftime('%d.%m.%Y')
     else:
         deadline_text = "без дедлайна"
@@ -996,39 +909,28 @@ async def complete_extend_task(callback, state: FSMContext, new_deadline):
 
 async def enforce_task_limits(user_id: int, status: str):
     """Принудительное соблюдение лимитов задач"""
+    if status not in ('completed', 'failed', 'overdue'):
+        return  # Активные задачи и неизвестные статусы не удаляются
+
     try:
         async with db.pool.acquire() as conn:
-            count = await conn.fetchval(
-                "SELECT COUNT(*) FROM tasks WHERE user_id = $1 AND status = $2",
-                user_id, status
+            # Оставляем только N самых свежих задач со статусом одним запросом, без COUNT
+            result = await conn.execute(
+                """DELETE FROM tasks WHERE task_id IN (
+                    SELECT task_id FROM tasks
+                    WHERE user_id = $1 AND status = $2
+                    ORDER BY COALESCE(completed_at, marked_overdue_at) DESC, task_id DESC
+                    OFFSET $3
+                )""",
+                user_id, status, TASK_LIMITS[status]
             )
-            
-            if count > TASK_LIMITS[status]:
-                excess = count - TASK_LIMITS[status]
-                
-                # Определяем поле для сортировки и SQL запрос
-                if status == 'completed':
-                    order_field = 'completed_at'
-                elif status == 'failed':
-                    order_field = 'completed_at'
-                elif status == 'overdue':
-                    order_field = 'marked_overdue_at'
-                else:
-                    return  # Неизвестный статус
-                
-                await conn.execute(
-                    f"""DELETE FROM tasks WHERE task_id IN (
-                        SELECT task_id FROM tasks 
-                        WHERE user_id = $1 AND status = $2
-                        ORDER BY {order_field} ASC LIMIT $3
-                    )""",
-                    user_id, status, excess
-                )
-                
-                logger.info(f"Enforced limit for user {user_id}, status {status}, deleted {excess} tasks")
-                
-                # После принудительной очистки задач, очищаем неиспользуемые категории
-                await cleanup_unused_categories(user_id)
+
+        deleted = int(result.split()[-1])
+        if deleted:
+            logger.info(f"Enforced limit for user {user_id}, status {status}, deleted {deleted} tasks")
+
+            # После принудительной очистки задач, очищаем неиспользуемые категории
+            await cleanup_unused_categories(user_id)
     
     except Exception as e:
         logger.error(f"Error enforcing task limits: {e}")
\ No newline at end of file
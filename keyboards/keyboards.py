@@ -2,55 +2,99 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeybo
 from config import POPULAR_TIMEZONES
 from typing import List, Tuple, Optional
 
-def get_timezone_keyboard():
-    """Клавиатура для выбора часового пояса"""
-    keyboard = []
-    for tz_code, tz_name in POPULAR_TIMEZONES:
-        keyboard.append([InlineKeyboardButton(text=tz_name, callback_data=f"tz_{tz_code}")])
-    
-    keyboard.append([InlineKeyboardButton(text="📍 Отправить геолокацию", callback_data="send_location")])
-    
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+# Статические клавиатуры строятся один раз при импорте и переиспользуются во всех хендлерах
 
-def get_main_menu_keyboard():
-    """Главное меню (custom keyboard)"""
-    keyboard = [
+_TIMEZONE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=tz_name, callback_data=f"tz_{tz_code}")]
+    for tz_code, tz_name in POPULAR_TIMEZONES
+] + [
+    [InlineKeyboardButton(text="📍 Отправить геолокацию", callback_data="send_location")]
+])
+
+_MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
         [KeyboardButton(text="⏰ Напоминания")],
         [KeyboardButton(text="📝 Задачи")],
         [KeyboardButton(text="📔 Дневник")],
         [KeyboardButton(text="🌍 Изменить часовой пояс")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True, one_time_keyboard=False)
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=False
+)
 
-def get_reminders_menu_keyboard():
-    """Меню напоминаний"""
-    keyboard = [
+_REMINDERS_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
         [KeyboardButton(text="➕ Разовое напоминание")],
         [KeyboardButton(text="🔄 Повторяющееся напоминание")],
         [KeyboardButton(text="📋 Список напоминаний")],
         [KeyboardButton(text="🏠 Главное меню")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    ],
+    resize_keyboard=True
+)
 
-def get_tasks_menu_keyboard():
-    """Меню задач"""
-    keyboard = [
+_TASKS_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
         [KeyboardButton(text="➕ Создать новую задачу")],
         [KeyboardButton(text="👀 Просмотр задач")],
         [KeyboardButton(text="🏠 Главное меню")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    ],
+    resize_keyboard=True
+)
 
-def get_task_view_menu_keyboard():
-    """Меню просмотра задач"""
-    keyboard = [
+_TASK_VIEW_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
         [KeyboardButton(text="🔥 Активные")],
         [KeyboardButton(text="✅ Выполненные")],
         [KeyboardButton(text="❌ Невыполненные")],
         [KeyboardButton(text="⚠️ Просроченные")],
         [KeyboardButton(text="🏠 Главное меню")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    ],
+    resize_keyboard=True
+)
+
+_DEADLINE_SELECTION_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📅 До конца дня", callback_data="deadline_today")],
+    [InlineKeyboardButton(text="📅 До конца завтрашнего дня", callback_data="deadline_tomorrow")],
+    [InlineKeyboardButton(text="📆 До конца недели", callback_data="deadline_week")],
+    [InlineKeyboardButton(text="🗓 До конца месяца", callback_data="deadline_month")],
+    [InlineKeyboardButton(text="📊 До конца года", callback_data="deadline_year")],
+    [InlineKeyboardButton(text="⏰ Свой дедлайн", callback_data="deadline_custom")],
+    [InlineKeyboardButton(text="🚫 Без дедлайна", callback_data="deadline_none")]
+])
+
+_DIARY_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="✍️ Новая запись")],
+        [KeyboardButton(text="📖 Просмотр записей")],
+        [KeyboardButton(text="🏠 Главное меню")]
+    ],
+    resize_keyboard=True
+)
+
+_BACK_TO_MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="🏠 Главное меню")]],
+    resize_keyboard=True
+)
+
+def get_timezone_keyboard():
+    """Клавиатура для выбора часового пояса"""
+    return _TIMEZONE_KEYBOARD
+
+def get_main_menu_keyboard():
+    """Главное меню (custom keyboard)"""
+    return _MAIN_MENU_KEYBOARD
+
+def get_reminders_menu_keyboard():
+    """Меню напоминаний"""
+    return _REMINDERS_MENU_KEYBOARD
+
+def get_tasks_menu_keyboard():
+    """Меню задач"""
+    return _TASKS_MENU_KEYBOARD
+
+def get_task_view_menu_keyboard():
+    """Меню просмотра задач"""
+    return _TASK_VIEW_MENU_KEYBOARD
 
 def get_category_selection_keyboard(categories: List[Tuple[int, str]], max_display: int = 10):
     """Клавиатура для выбора категории задачи"""
@@ -74,16 +118,7 @@ def get_category_selection_keyboard(categories: List[Tuple[int, str]], max_displ
 
 def get_deadline_selection_keyboard():
     """Клавиатура для выбора дедлайна"""
-    keyboard = [
-        [InlineKeyboardButton(text="📅 До конца дня", callback_data="deadline_today")],
-        [InlineKeyboardButton(text="📅 До конца завтрашнего дня", callback_data="deadline_tomorrow")],
-        [InlineKeyboardButton(text="📆 До конца недели", callback_data="deadline_week")],
-        [InlineKeyboardButton(text="🗓 До конца месяца", callback_data="deadline_month")],
-        [InlineKeyboardButton(text="📊 До конца года", callback_data="deadline_year")],
-        [InlineKeyboardButton(text="⏰ Свой дедлайн", callback_data="deadline_custom")],
-        [InlineKeyboardButton(text="🚫 Без дедлайна", callback_data="deadline_none")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return _DEADLINE_SELECTION_KEYBOARD
 
 def get_task_action_keyboard(task_id: int, task_status: str):
     """Клавиатура действий с задачей"""
@@ -107,16 +142,8 @@ def get_task_action_keyboard(task_id: int, task_status: str):
 
 def get_diary_menu_keyboard():
     """Меню дневника"""
-    keyboard = [
-        [KeyboardButton(text="✍️ Новая запись")],
-        [KeyboardButton(text="📖 Просмотр записей")],
-        [KeyboardButton(text="🏠 Главное меню")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return _DIARY_MENU_KEYBOARD
 
 def get_back_to_main_keyboard():
     """Кнопка возврата в главное меню"""
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="🏠 Главное меню")]],
-        resize_keyboard=True
-    )
\ No newline at end of file
+    return _BACK_TO_MAIN_KEYBOARD
\ No newline at end of file
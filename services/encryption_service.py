@@ -1,13 +1,90 @@
-import base64
+import asyncio
+import os
 import secrets
+import threading
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import logging
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional
+
+# SIMD-ускоренный base64 (AVX2/NEON), при отсутствии - стандартный модуль
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 
 logger = logging.getLogger(__name__)
 
+# Токены Fernet всегда начинаются с байта версии 0x80 и старших нулевых байтов времени,
+# поэтому в base64 имеют этот префикс. Старые токены дополнительно обернуты в base64
+FERNET_TOKEN_PREFIX = "gAAAAA"
+FERNET_TOKEN_PREFIX_BYTES = FERNET_TOKEN_PREFIX.encode('ascii')
+FERNET_TOKEN_VERSION = 0x80
+
+# Формат AES-GCM: версия || nonce || шифротекст с тегом (в тексте - в urlsafe base64).
+# Версия 0x02 - ключ выведен из мастер-ключа через PBKDF2,
+# версия 0x03 - мастер-ключ уже является случайным 32-байтным ключом и PBKDF2 не используется
+AESGCM_TOKEN_VERSION = 0x02
+AESGCM_RAW_KEY_TOKEN_VERSION = 0x03
+AESGCM_NONCE_SIZE = 12
+
+# Префикс мастер-ключа, который используется без PBKDF2 (ставит generate_encryption_key()).
+# Без префикса любой мастер-ключ считается парольной фразой
+RAW_KEY_PREFIX = "raw:"
+
+# Текст, которым заменяются данные, которые не удалось расшифровать
+DECRYPTION_ERROR_TEXT = "[Ошибка расшифровки]"
+
+# Пакеты от этого размера расшифровываются в отдельном потоке
+THREAD_OFFLOAD_MIN_ITEMS = 8
+
+@lru_cache(maxsize=8)
+def _derive_key(master_key: str) -> bytes:
+    """
+    Получение 32-байтного ключа из мастер-ключа через PBKDF2
+    
+    100 000 итераций PBKDF2 выполняются один раз на процесс для каждого мастер-ключа
+    
+    Args:
+        master_key: Мастер-ключ в виде строки
+        
+    Returns:
+        Производный ключ
+    """
+    # Используем фиксированную соль для постоянства ключа
+    # В продакшене лучше хранить соль отдельно
+    salt = b'salt_for_tg_planner_bot_2024'
+    
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=100000,
+    )
+    return kdf.derive(master_key.encode())
+
+def _decode_raw_key(master_key: str) -> Optional[bytes]:
+    """
+    Строгое декодирование случайного 32-байтного ключа из urlsafe base64
+    
+    Args:
+        master_key: Мастер-ключ без префикса raw:
+        
+    Returns:
+        32 байта ключа или None, если строка не является таким ключом
+    """
+    if len(master_key) not in (43, 44):
+        return None
+    try:
+        raw_key = base64.b64decode(master_key + '=' * (-len(master_key) % 4), altchars=b'-_', validate=True)
+    except ValueError:
+        return None
+    return raw_key if len(raw_key) == 32 else None
+
 class EncryptionService:
     def __init__(self, master_key: str):
         """
@@ -19,10 +96,39 @@ class EncryptionService:
         if not master_key:
             raise ValueError("Master key is required for encryption")
         
-        # Генерируем ключ для Fernet из мастер-ключа
-        self.fernet = self._create_fernet_key(master_key)
+        raw_mode = master_key.startswith(RAW_KEY_PREFIX)
+        if raw_mode:
+            master_key = master_key[len(RAW_KEY_PREFIX):]
+        
+        self._master_key = master_key
+        self._fernet: Optional[Fernet] = None
+        self._legacy_aead: Optional[AESGCM] = None
+        self._raw_key_aead: Optional[AESGCM] = None
+        
+        if raw_mode:
+            raw_key = _decode_raw_key(master_key)
+            if raw_key is None:
+                raise ValueError(f"Master key with '{RAW_KEY_PREFIX}' prefix must be 32 bytes in urlsafe base64")
+            # Случайный 256-битный ключ не нуждается в растяжении через PBKDF2
+            logger.info("Raw master key in use, PBKDF2 is skipped")
+            self.token_version = AESGCM_RAW_KEY_TOKEN_VERSION
+            self.aead = self._create_aead(raw_key)
+            self._raw_key_aead = self.aead
+        else:
+            self.token_version = AESGCM_TOKEN_VERSION
+            self.aead = self._create_aead(_derive_key(master_key))
+            self._legacy_aead = self.aead
+        # Байт версии общий для всех токенов этого экземпляра
+        self._token_prefix = bytes((self.token_version,))
         logger.info("Encryption service initialized")
     
+    @property
+    def fernet(self) -> Fernet:
+        """Fernet для токенов старого формата (PBKDF2 выполняется при первом обращении)"""
+        if self._fernet is None:
+            self._fernet = self._create_fernet_key(self._master_key)
+        return self._fernet
+    
     def _create_fernet_key(self, master_key: str) -> Fernet:
         """
         Создание ключа Fernet из мастер-ключа
@@ -33,18 +139,87 @@ class EncryptionService:
         Returns:
             Объект Fernet для шифрования/расшифровки
         """
-        # Используем фиксированную соль для постоянства ключа
-        # В продакшене лучше хранить соль отдельно
-        salt = b'salt_for_tg_planner_bot_2024'
+        key = base64.urlsafe_b64encode(_derive_key(master_key))
+        return Fernet(key)
+    
+    def _create_aead(self, key: bytes) -> AESGCM:
+        """
+        Создание шифра AES-256-GCM
+        
+        Ключ AES-GCM выводится через HKDF с отдельным контекстом,
+        чтобы не использовать один и тот же ключ в Fernet и AES-GCM
         
-        kdf = PBKDF2HMAC(
+        Args:
+            key: Ключ PBKDF2 или случайный 32-байтный мастер-ключ
+            
+        Returns:
+            Объект AESGCM для шифрования/расшифровки
+        """
+        hkdf = HKDF(
             algorithm=hashes.SHA256(),
             length=32,
-            salt=salt,
-            iterations=100000,
+            salt=None,
+            info=b'tg_planner_bot aes-256-gcm',
         )
-        key = base64.urlsafe_b64encode(kdf.derive(master_key.encode()))
-        return Fernet(key)
+        return AESGCM(hkdf.derive(key))
+    
+    def _get_aead(self, version: int) -> AESGCM:
+        """
+        Получение шифра AES-GCM для версии токена
+        
+        Args:
+            version: Байт версии токена
+            
+        Returns:
+            Объект AESGCM, которым был зашифрован токен
+        """
+        if version == self.token_version:
+            return self.aead
+        if version == AESGCM_TOKEN_VERSION:
+            # Токен записан до перехода на случайный мастер-ключ
+            if self._legacy_aead is None:
+                self._legacy_aead = self._create_aead(_derive_key(self._master_key))
+            return self._legacy_aead
+        if version == AESGCM_RAW_KEY_TOKEN_VERSION:
+            # Токен записан, когда ключ без префикса распознавался как случайный
+            if self._raw_key_aead is None:
+                raw_key = _decode_raw_key(self._master_key)
+                if raw_key is None:
+                    raise ValueError(f"Token version {version} does not match the master key")
+                self._raw_key_aead = self._create_aead(raw_key)
+            return self._raw_key_aead
+        raise ValueError(f"Token version {version} does not match the master key")
+    
+    def encrypt_bytes(self, data: bytes) -> bytes:
+        """
+        Шифрование байтов без текстовой обертки
+        
+        Args:
+            data: Байты для шифрования
+            
+        Returns:
+            Сырой токен AES-GCM: версия || nonce || шифротекст с тегом
+        """
+        nonce = os.urandom(AESGCM_NONCE_SIZE)
+        # join выделяет память под токен один раз, без промежуточных объектов
+        return b''.join((self._token_prefix, nonce, self.aead.encrypt(nonce, data, None)))
+    
+    def decrypt_bytes(self, token: bytes) -> bytes:
+        """
+        Расшифровка сырого токена
+        
+        Args:
+            token: Сырой токен AES-GCM или сырой (без base64) токен Fernet
+            
+        Returns:
+            Расшифрованные байты
+        """
+        if token[0] in (AESGCM_TOKEN_VERSION, AESGCM_RAW_KEY_TOKEN_VERSION):
+            nonce = token[1:AESGCM_NONCE_SIZE + 1]
+            return self._get_aead(token[0]).decrypt(nonce, token[AESGCM_NONCE_SIZE + 1:], None)
+        if token[0] == FERNET_TOKEN_VERSION:
+            return self.fernet.decrypt(base64.urlsafe_b64encode(token))
+        raise ValueError(f"Unknown token version: {token[0]}")
     
     def encrypt(self, data: str) -> str:
         """
@@ -54,16 +229,15 @@ class EncryptionService:
             data: Строка для шифрования
             
         Returns:
-            Зашифрованная строка в base64
+            Токен AES-GCM (urlsafe base64)
         """
         if not data:
             return ""
         
         try:
-            encrypted_data = self.fernet.encrypt(data.encode('utf-8'))
-            return base64.urlsafe_b64encode(encrypted_data).decode('utf-8')
+            return base64.urlsafe_b64encode(self.encrypt_bytes(data.encode('utf-8'))).decode('ascii')
         except Exception as e:
-            logger.error(f"Encryption failed: {e}")
+            logger.error("Encryption failed: %s", e)
             raise
     
     def decrypt(self, encrypted_data: str) -> str:
@@ -71,7 +245,7 @@ class EncryptionService:
         Расшифровка строки
         
         Args:
-            encrypted_data: Зашифрованная строка в base64
+            encrypted_data: Токен AES-GCM, токен Fernet или токен Fernet в двойном base64
             
         Returns:
             Расшифрованная строка
@@ -80,11 +254,19 @@ class EncryptionService:
             return ""
         
         try:
-            decoded_data = base64.urlsafe_b64decode(encrypted_data.encode('utf-8'))
-            decrypted_data = self.fernet.decrypt(decoded_data)
-            return decrypted_data.decode('utf-8')
+            token = encrypted_data.encode('ascii')
+            if encrypted_data.startswith(FERNET_TOKEN_PREFIX):
+                # Токен Fernet без дополнительной обертки
+                return self.fernet.decrypt(token).decode('utf-8')
+            
+            raw = base64.urlsafe_b64decode(token)
+            if raw.startswith(FERNET_TOKEN_PREFIX_BYTES):
+                # Старый формат: токен Fernet, дополнительно обернутый в base64
+                return self.fernet.decrypt(raw).decode('utf-8')
+            
+            return self.decrypt_bytes(raw).decode('utf-8')
         except Exception as e:
-            logger.error(f"Decryption failed: {e}")
+            logger.error("Decryption failed: %s", e)
             raise
     
     def encrypt_if_not_none(self, data: Optional[str]) -> Optional[str]:
@@ -110,32 +292,81 @@ class EncryptionService:
             Расшифрованная строка или None
         """
         return self.decrypt(encrypted_data) if encrypted_data is not None else None
+    
+    def encrypt_many(self, items: List[Optional[str]]) -> List[Optional[str]]:
+        """
+        Пакетное шифрование списка строк
+        
+        Args:
+            items: Строки для шифрования (None сохраняется как None)
+            
+        Returns:
+            Список зашифрованных строк в том же порядке
+        """
+        encrypt = self.encrypt
+        return [encrypt(item) if item is not None else None for item in items]
+    
+    def decrypt_many(self, encrypted_items: List[Optional[str]],
+                     on_error: Optional[str] = None) -> List[Optional[str]]:
+        """
+        Пакетная расшифровка списка строк
+        
+        Args:
+            encrypted_items: Зашифрованные строки (None сохраняется как None)
+            on_error: Значение для элементов, которые не удалось расшифровать;
+                если не задано, ошибка пробрасывается
+            
+        Returns:
+            Список расшифрованных строк в том же порядке
+        """
+        decrypt = self.decrypt
+        decrypted_items = []
+        for encrypted_data in encrypted_items:
+            if encrypted_data is None:
+                decrypted_items.append(None)
+                continue
+            try:
+                decrypted_items.append(decrypt(encrypted_data))
+            except Exception:
+                if on_error is None:
+                    raise
+                decrypted_items.append(on_error)
+        return decrypted_items
 
 def generate_encryption_key() -> str:
     """
     Генерация случайного ключа шифрования
     
+    Значение подходит для ENCRYPTION_KEY: благодаря префиксу raw: такой ключ
+    используется напрямую, без 100 000 итераций PBKDF2 при запуске
+    
     Returns:
         Случайный ключ в виде строки
     """
-    return base64.urlsafe_b64encode(secrets.token_bytes(32)).decode('utf-8')
+    return RAW_KEY_PREFIX + secrets.token_urlsafe(32)
 
 # Глобальный экземпляр сервиса шифрования
 _encryption_service: Optional[EncryptionService] = None
+_encryption_service_lock = threading.Lock()
 
 def get_encryption_service() -> EncryptionService:
     """
     Получение глобального экземпляра сервиса шифрования
     
+    Создание защищено блокировкой, чтобы при одновременном первом вызове
+    из нескольких потоков вывод ключа выполнялся только один раз
+    
     Returns:
         Экземпляр EncryptionService
     """
     global _encryption_service
     if _encryption_service is None:
-        from config import ENCRYPTION_KEY
-        if not ENCRYPTION_KEY:
-            raise ValueError("ENCRYPTION_KEY not found in environment variables")
-        _encryption_service = EncryptionService(ENCRYPTION_KEY)
+        with _encryption_service_lock:
+            if _encryption_service is None:
+                from config import ENCRYPTION_KEY
+                if not ENCRYPTION_KEY:
+                    raise ValueError("ENCRYPTION_KEY not found in environment variables")
+                _encryption_service = EncryptionService(ENCRYPTION_KEY)
     return _encryption_service
 
 def encrypt_text(text: str) -> str:
@@ -144,4 +375,19 @@ def encrypt_text(text: str) -> str:
 
 def decrypt_text(encrypted_text: str) -> str:
     """Быстрый доступ к расшифровке"""
-    return get_encryption_service().decrypt(encrypted_text)
\ No newline at end of file
+    return get_encryption_service().decrypt(encrypted_text)
+
+def decrypt_texts(encrypted_texts: List[Optional[str]], on_error: Optional[str] = None) -> List[Optional[str]]:
+    """Быстрый доступ к пакетной расшифровке"""
+    return get_encryption_service().decrypt_many(encrypted_texts, on_error)
+
+async def decrypt_texts_async(encrypted_texts: List[Optional[str]], on_error: Optional[str] = None) -> List[Optional[str]]:
+    """
+    Пакетная расшифровка без блокировки event loop
+    
+    Большие пакеты расшифровываются в пуле потоков, маленькие - на месте,
+    где передача в поток обошлась бы дороже самой расшифровки
+    """
+    if len(encrypted_texts) < THREAD_OFFLOAD_MIN_ITEMS:
+        return decrypt_texts(encrypted_texts, on_error)
+    return await asyncio.to_thread(decrypt_texts, encrypted_texts, on_error)
@@ -1,118 +1,185 @@
-from openai import AsyncOpenAI
+import asyncio
+import orjson
+from datetime import datetime
+import httpx
+from importlib.util import find_spec
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from config import OPENAI_API_KEY
 import logging
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
-# Настройка OpenAI
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Максимальное время чтения потокового ответа, секунд
+OPENAI_STREAM_TIMEOUT = 30
+
+# Клиент OpenAI создается при первом запросе
+_client: Optional[AsyncOpenAI] = None
+
+def _get_client() -> AsyncOpenAI:
+    """
+    Получение клиента OpenAI с общим пулом соединений
+    
+    HTTP/2 включается, только если установлен пакет h2
+    """
+    global _client
+    if _client is None:
+        http_client = DefaultAsyncHttpxClient(
+            http2=find_spec("h2") is not None,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+        _client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+    return _client
+
+# Мотивационное сообщение одно на день для всех пользователей: дата (UTC) -> текст
+_motivation_cache = {}
+_motivation_lock = asyncio.Lock()
+
+# Шаблоны системных промптов: подставляются только текущее время и часовой пояс
+ONCE_REMINDER_PROMPT = """
+Ты помощник для парсинга времени разовых напоминаний. 
+Текущее время: {current_time}
+Часовой пояс пользователя: {timezone}
+
+Преобразуй пользовательский ввод в JSON формат:
+
+{{
+    "type": "once",
+    "datetime": "YYYY-MM-DD HH:MM:SS",
+    "success": true
+}}
+
+Если не удалось составить, верни:
+{{
+    "success": false,
+    "error": "описание проблемы"
+}}
+
+Будь внимателен если пользователь указывает время в секундах.
+Важно: возвращай ТОЛЬКО JSON, без дополнительного текста.
+"""
+
+RECURRING_REMINDER_PROMPT = """
+Ты помощник для парсинга времени повторяющихся напоминаний. 
+Текущее время: {current_time}
+Часовой пояс пользователя: {timezone}
+
+Преобразуй пользовательский ввод в JSON формат:
+
+{{
+    "type": "recurring",
+    "cron": "* * * * *",
+    "description": "описание расписания",  //строгое описание, переводи секунды в минуты
+    "success": true
+}}
+
+Если не удалось составить, верни:
+{{
+    "success": false,
+    "error": "описание проблемы"
+}}
+
+Будь внимателен если пользователь указывает время в секундах. Конвертируй при необходимости.
+Важно: возвращай ТОЛЬКО JSON, без дополнительного текста.
+"""
+
+async def _read_json_stream(stream) -> dict:
+    """
+    Чтение потокового ответа до первого полного JSON-объекта
+    
+    Поток закрывается сразу после того, как накопленный текст разобрался как JSON,
+    не дожидаясь окончания генерации
+    """
+    parts = []
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            
+            # Объект может закончиться только на закрывающей скобке
+            if '}' in delta:
+                try:
+                    return orjson.loads(''.join(parts))
+                except orjson.JSONDecodeError:
+                    continue
+    finally:
+        await stream.close()
+    
+    # Поток завершился без полного объекта - отдаем ошибку разбора
+    return orjson.loads(''.join(parts))
 
 async def parse_reminder_time(user_input: str, current_time: str, timezone: str, reminder_type: str):
     """
     Парсит пользовательский ввод времени напоминания через OpenAI
     """
     try:
-        if reminder_type == "once":
-            system_prompt = f"""
-            Ты помощник для парсинга времени разовых напоминаний. 
-            Текущее время: {current_time}
-            Часовой пояс пользователя: {timezone}
-
-            Преобразуй пользовательский ввод в JSON формат:
-            
-            {{
-                "type": "once",
-                "datetime": "YYYY-MM-DD HH:MM:SS",
-                "success": true
-            }}
-            
-            Если не удалось составить, верни:
-            {{
-                "success": false,
-                "error": "описание проблемы"
-            }}
-            
-            Будь внимателен если пользователь указывает время в секундах.
-            Важно: возвращай ТОЛЬКО JSON, без дополнительного текста.
-            """
-        else:  # recurring
-            system_prompt = f"""
-            Ты помощник для парсинга времени повторяющихся напоминаний. 
-            Текущее время: {current_time}
-            Часовой пояс пользователя: {timezone}
-
-            Преобразуй пользовательский ввод в JSON формат:
-            
-            {{
-                "type": "recurring",
-                "cron": "* * * * *",
-                "description": "описание расписания",  //строгое описание, переводи секунды в минуты
-                "success": true
-            }}
-            
-            Если не удалось составить, верни:
-            {{
-                "success": false,
-                "error": "описание проблемы"
-            }}
-            
-            Будь внимателен если пользователь указывает время в секундах. Конвертируй при необходимости.
-            Важно: возвращай ТОЛЬКО JSON, без дополнительного текста.
-            """
+        template = ONCE_REMINDER_PROMPT if reminder_type == "once" else RECURRING_REMINDER_PROMPT
+        system_prompt = template.format_map({"current_time": current_time, "timezone": timezone})
         
         user_prompt = f"Пользователь хочет создать напоминание: {user_input}"
         
-        response = await client.chat.completions.create(
+        stream = await _get_client().chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.3,
-            max_tokens=200
+            max_tokens=200,
+            response_format={"type": "json_object"},
+            stream=True
         )
         
-
-        result_text = response.choices[0].message.content.strip()
-        
-        # Пытаемся извлечь JSON из ответа
-        if result_text.startswith('```json'):
-            result_text = result_text[7:]
-        if result_text.endswith('```'):
-            result_text = result_text[:-3]
-        
-        import json
-        result = json.loads(result_text)
-        return result
+        return await asyncio.wait_for(_read_json_stream(stream), timeout=OPENAI_STREAM_TIMEOUT)
         
     except Exception as e:
-        logger.error(f"Error parsing reminder time with OpenAI: {e}")
+        logger.error("Error parsing reminder time with OpenAI: %s", e)
         return {
             "success": False,
             "error": f"Ошибка обработки: {str(e)}"
         }
 
 async def generate_daily_motivation():
-    """Генерирует мотивационное сообщение на день"""
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "Ты помощник, который создает короткие мотивационные сообщения на день. Сообщение должно быть вдохновляющим, но не банальным и не длиннее 100 символов."
-                },
-                {
-                    "role": "user", 
-                    "content": "Создай мотивационное сообщение на новый день"
-                }
-            ],
-            temperature=0.7,
-            max_tokens=50
-        )
-        
-        return response.choices[0].message.content.strip()
+    """Генерирует мотивационное сообщение на день (запрос к OpenAI - не чаще раза в сутки)"""
+    date_key = datetime.utcnow().strftime('%Y-%m-%d')
+    motivation = _motivation_cache.get(date_key)
+    if motivation is not None:
+        return motivation
     
-    except Exception as e:
-        logger.error(f"Error generating daily motivation: {e}")
-        return "Доброе утро! Сегодня отличный день для новых свершений! 🌟"
\ No newline at end of file
+    async with _motivation_lock:
+        # Пока ждали блокировку, сообщение мог получить другой вызов
+        motivation = _motivation_cache.get(date_key)
+        if motivation is not None:
+            return motivation
+        
+        try:
+            response = await _get_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {
+                        "role": "system", 
+                        "content": "Ты помощник, который создает короткие мотивационные сообщения на день. Сообщение должно быть вдохновляющим, но не банальным и не длиннее 100 символов."
+                    },
+                    {
+                        "role": "user", 
+                        "content": "Создай мотивационное сообщение на новый день"
+                    }
+                ],
+                temperature=0.7,
+                max_tokens=50
+            )
+            motivation = response.choices[0].message.content.strip()
+        
+        except Exception as e:
+            # Запасное сообщение не кэшируем, чтобы следующий вызов снова обратился к OpenAI
+            logger.error("Error generating daily motivation: %s", e)
+            return "Доброе утро! Сегодня отличный день для новых свершений! 🌟"
+        
+        # Храним только сообщение текущего дня
+        _motivation_cache.clear()
+        _motivation_cache[date_key] = motivation
+        return motivation
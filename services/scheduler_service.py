@@ -1,27 +1,63 @@
 import asyncio
+from apscheduler.events import EVENT_JOB_ERROR
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime, time, timedelta
-import calendar
-import pytz
+from functools import lru_cache
+from collections import defaultdict
 import logging
-import asyncpg
 
-from services.timezone_service import convert_user_time_to_scheduler_timezone, get_scheduler_timezone, get_user_time
+from services.timezone_service import get_scheduler_timezone, get_user_time, get_zoneinfo
 from database.connection import db
 from services.openai_service import generate_daily_motivation
-from services.encryption_service import decrypt_text
+from services.encryption_service import decrypt_texts_async, DECRYPTION_ERROR_TEXT
 from aiogram import types
+from aiogram.exceptions import TelegramRetryAfter
 from handlers.admin import send_daily_backup
+from handlers.tasks import TASK_LIMITS
+from config import SKIP_EMPTY_EVENING_REVIEW
 
 logger = logging.getLogger(__name__)
 
+# Задержка пакетного удаления сработавших разовых напоминаний, секунд
+ONCE_REMINDER_DELETE_INTERVAL = 5
+
+# Сколько секунд задача может опоздать (например, при занятом event loop) и все равно выполниться
+JOB_MISFIRE_GRACE_TIME = 300
+
+# Максимум одновременных отправок при рассылке (ограничивает число запросов в полете, а не темп)
+BROADCAST_CONCURRENCY = 20
+
+# Темп рассылки, сообщений в секунду (глобальный лимит Telegram ~30 сообщений/с)
+BROADCAST_RATE = 25
+
+# Сколько раз повторять отправку после ответа 429 (TelegramRetryAfter)
+BROADCAST_MAX_RETRIES = 3
+
+# Заголовки рассылаемых сообщений
+REMINDER_MESSAGE_PREFIX = "⏰ Напоминание:\n\n"
+MOTIVATION_MESSAGE_PREFIX = "🌅 Доброе утро!\n\n"
+
+# Сообщения встроенного напоминания по периодам: (тип_периода, текст_сообщения)
+SMART_REMINDER_MESSAGES = {
+    'year': ("год", "🎊 Год подходит к концу! Время подвести итоги года и поставить цели на следующий год.\n\nОтметьте выполненные задачи года и составьте новые!"),
+    'month': ("месяц", "📅 Месяц подходит к концу! Время проанализировать достижения месяца.\n\nОтметьте выполненные задачи месяца и составьте новые!"),
+    'week': ("неделя", "📊 Неделя завершается! Отличное время подвести итоги недели.\n\nОтметьте выполненные задачи недели и составьте новые!"),
+    'day': ("день", "🌅 День подходит к концу! Время подвести итоги дня.\n\nОтметьте выполненные задачи дня и составьте новые!")
+}
+
+
+# Число дней в месяцах невисокосного года
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
 
 def is_last_day_of_month(date: datetime) -> bool:
     """Проверяет, является ли дата последним днём месяца"""
-    last_day = calendar.monthrange(date.year, date.month)[1]
-    return date.day == last_day
+    year = date.year
+    is_leap_february = date.month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    return date.day == _DAYS_IN_MONTH[date.month - 1] + is_leap_february
 
 
 def parse_cron_expression(cron_expr: str, timezone) -> CronTrigger | None:
@@ -35,121 +71,171 @@ def parse_cron_expression(cron_expr: str, timezone) -> CronTrigger | None:
 
     minute, hour, day, month, day_of_week = parts
 
-    # Если есть L в поле day → делаем CronTrigger на каждый день
+    # L в поле day → последний день месяца, APScheduler поддерживает это как "last"
     if day == "L":
-        return CronTrigger(
-            minute=minute,
-            hour=hour,
-            day="*",
-            month=month,
-            day_of_week=day_of_week,
-            timezone=timezone
-        )
-    else:
-        return CronTrigger(
-            minute=minute,
-            hour=hour,
-            day=day,
-            month=month,
-            day_of_week=day_of_week,
-            timezone=timezone
-        )
+        day = "last"
+
+    return CronTrigger(
+        minute=minute,
+        hour=hour,
+        day=day,
+        month=month,
+        day_of_week=day_of_week,
+        timezone=timezone
+    )
+
+
+@lru_cache(maxsize=1024)
+def compile_cron_expression(cron_expr: str, timezone_str: str) -> CronTrigger | None:
+    """
+    Кэшированная сборка триггера по cron-выражению и имени часового пояса.
+    Напоминания с одинаковым расписанием в одном поясе разделяют один CronTrigger.
+    """
+    return parse_cron_expression(cron_expr, get_zoneinfo(timezone_str))
 
 
 class SchedulerService:
     def __init__(self, bot):
-        self.scheduler = AsyncIOScheduler(timezone=pytz.UTC)
+        # Задачи хранятся в памяти: в аргументах лежат расшифрованные тексты, а при запуске
+        # они все равно восстанавливаются из БД в load_active_reminders
+        self.scheduler = AsyncIOScheduler(
+            timezone=get_zoneinfo("UTC"),
+            job_defaults={
+                'coalesce': True,
+                'misfire_grace_time': JOB_MISFIRE_GRACE_TIME
+            }
+        )
         self.bot = bot
+        # id сработавших разовых напоминаний, ожидающих удаления из БД
+        self._pending_once_deletes = set()
+        # Время event loop, раньше которого не начинается следующая отправка рассылки
+        self._next_broadcast_slot = 0.0
 
     async def start(self):
         """Запуск планировщика"""
-        self.scheduler.start()
+        # Запускаем на паузе, чтобы массовое добавление задач не будило планировщик
+        # на каждый add_job: очередь задач просматривается один раз при resume()
+        # Ошибки задач логируются в одном месте, а не в каждом методе-задаче
+        self.scheduler.add_listener(self._on_job_error, EVENT_JOB_ERROR)
+        self.scheduler.start(paused=True)
+        try:
+            await self._purge_expired_once_reminders()
+            await self.load_active_reminders()
+            await self.setup_user_system_tasks()
+        finally:
+            self.scheduler.resume()
         logger.info("Scheduler started")
 
-        await self.load_active_reminders()
-        await self.setup_user_system_tasks()
+    def _on_job_error(self, event):
+        """Логирование исключения, выброшенного задачей планировщика (трейсбек пишет сам APScheduler)"""
+        logger.error(f"Job {event.job_id} failed: {event.exception}")
 
     async def stop(self):
         """Остановка планировщика"""
         self.scheduler.shutdown(wait=False)
+        await self._flush_once_reminder_deletes()
         logger.info("Scheduler stopped")
 
-    def _decrypt_reminder_text(self, encrypted_text: str, reminder_id: int) -> str:
-        """Вспомогательный метод для расшифровки текста напоминаний"""
+    async def _purge_expired_once_reminders(self):
+        """
+        Удаление активных разовых напоминаний, время которых уже прошло
+        
+        Очередь удаления сработавших напоминаний хранится в памяти и теряется при
+        перезапуске, а такие напоминания иначе навсегда остались бы в списке пользователя
+        """
         try:
-            return decrypt_text(encrypted_text)
+            result = await db.execute("""
+                DELETE FROM reminders r
+                USING users u
+                WHERE r.user_id = u.user_id
+                  AND r.is_active = TRUE
+                  AND r.reminder_type = 'once'
+                  AND r.trigger_time AT TIME ZONE u.timezone <= NOW()
+            """)
+            logger.info(f"Purged {int(result.split()[-1])} expired once reminders")
         except Exception as e:
-            logger.error(f"Failed to decrypt reminder {reminder_id}: {e}")
-            return "[Ошибка расшифровки]"
-
-    async def _load_reminders_by_type(self, reminder_type: str) -> list:
-        """Загрузка напоминаний определенного типа"""
-        conditions = {
-            'once': "r.reminder_type = 'once' AND r.is_active = TRUE AND r.trigger_time > NOW()",
-            'recurring': "r.reminder_type = 'recurring' AND r.is_active = TRUE"
-        }
+            logger.error(f"Error purging expired once reminders: {e}")
+
+    async def _load_active_reminders(self, user_id: int = None) -> list:
+        """Загрузка активных напоминаний обоих типов одним запросом (всех или одного пользователя)"""
+        # Время разовых напоминаний хранится в часовом поясе пользователя -
+        # в часовой пояс планировщика оно переводится сразу в запросе
+        return await db.fetch("""
+            SELECT r.reminder_id, r.user_id, r.text, r.reminder_type,
+                   (r.trigger_time AT TIME ZONE u.timezone) AT TIME ZONE $2 AS scheduler_trigger_time,
+                   r.cron_expression, r.is_built_in, u.timezone
+            FROM reminders r
+            JOIN users u ON r.user_id = u.user_id
+            WHERE r.is_active = TRUE
+              AND ($1::bigint IS NULL OR r.user_id = $1)
+              AND (r.reminder_type = 'recurring'
+                   OR (r.reminder_type = 'once' AND r.trigger_time AT TIME ZONE u.timezone > NOW()))
+        """, user_id, get_scheduler_timezone())
+
+    async def load_active_reminders(self, user_id: int = None):
+        """
+        Загрузка активных напоминаний из базы данных с расшифровкой
         
-        fields = {
-            'once': "r.reminder_id, r.user_id, r.text, r.trigger_time, u.timezone",
-            'recurring': "r.reminder_id, r.user_id, r.text, r.cron_expression, u.timezone"
-        }
-
-        async with db.pool.acquire() as conn:
-            return await conn.fetch(f"""
-                SELECT {fields[reminder_type]}
-                FROM reminders r
-                JOIN users u ON r.user_id = u.user_id
-                WHERE {conditions[reminder_type]}
-            """)
-
-    async def load_active_reminders(self):
-        """Загрузка всех активных напоминаний из базы данных с расшифровкой"""
+        Без user_id загружаются напоминания всех пользователей
+        """
         try:
-            # Загружаем разовые напоминания
-            once_reminders = await self._load_reminders_by_type('once')
-            for reminder in once_reminders:
-                decrypted_text = self._decrypt_reminder_text(reminder['text'], reminder['reminder_id'])
-                scheduler_time = convert_user_time_to_scheduler_timezone(
-                    reminder['trigger_time'],
-                    reminder['timezone'],
-                    get_scheduler_timezone()
-                )
-                await self.add_once_reminder(
-                    reminder['reminder_id'],
-                    reminder['user_id'],
-                    decrypted_text,
-                    scheduler_time
-                )
-
-            # Загружаем повторяющиеся напоминания
-            recurring_reminders = await self._load_reminders_by_type('recurring')
-            for reminder in recurring_reminders:
-                decrypted_text = self._decrypt_reminder_text(reminder['text'], reminder['reminder_id'])
-                await self.add_recurring_reminder_with_timezone(
-                    reminder['reminder_id'],
-                    reminder['user_id'],
-                    decrypted_text,
-                    reminder['cron_expression'],
-                    reminder['timezone']
-                )
+            reminders = await self._load_active_reminders(user_id)
+            
+            # Расшифровываем все тексты одним пакетом вне event loop
+            texts = await decrypt_texts_async([reminder['text'] for reminder in reminders], on_error=DECRYPTION_ERROR_TEXT)
+            
+            once_count = 0
+            for reminder, decrypted_text in zip(reminders, texts):
+                if decrypted_text is DECRYPTION_ERROR_TEXT:
+                    logger.error(f"Failed to decrypt reminder {reminder['reminder_id']}")
+                
+                if reminder['reminder_type'] == 'once':
+                    once_count += 1
+                    await self.add_once_reminder(
+                        reminder['reminder_id'],
+                        reminder['user_id'],
+                        decrypted_text,
+                        reminder['scheduler_trigger_time']
+                    )
+                else:
+                    await self.add_recurring_reminder_with_timezone(
+                        reminder['reminder_id'],
+                        reminder['user_id'],
+                        decrypted_text,
+                        reminder['cron_expression'],
+                        reminder['timezone'],
+                        reminder['is_built_in']
+                    )
 
-            logger.info(f"Loaded {len(once_reminders)} once and {len(recurring_reminders)} recurring reminders")
+            logger.info(f"Loaded {once_count} once and {len(reminders) - once_count} recurring reminders")
 
         except Exception as e:
             logger.error(f"Error loading active reminders: {e}")
 
     async def add_recurring_reminder_with_timezone(self, reminder_id: int, user_id: int,
-                                                   text: str, cron_expression: str, user_timezone: str):
-        """Добавление повторяющегося напоминания с учетом часового пояса"""
+                                                   text: str, cron_expression: str, user_timezone: str,
+                                                   is_built_in: bool = False):
+        """
+        Добавление повторяющегося напоминания с учетом часового пояса
+        
+        Обычные напоминания отправляются задачей напрямую, встроенные - через выбор
+        текста по приоритету; при срабатывании БД не запрашивается
+        """
         try:
             job_id = f"reminder_recurring_{reminder_id}"
-            user_tz = pytz.timezone(user_timezone)
-            trigger = parse_cron_expression(cron_expression, user_tz)
+            trigger = compile_cron_expression(cron_expression, user_timezone)
+
+            if is_built_in:
+                # Текст встроенного напоминания выбирается в момент срабатывания
+                func, args = self._send_smart_recurring_reminder, [user_id, reminder_id, user_timezone]
+            else:
+                # Последний день месяца (L) учитывается самим триггером - отправляем напрямую
+                func, args = self.send_reminder, [user_id, text, reminder_id, 'recurring']
 
             self.scheduler.add_job(
-                self._wrapped_send_recurring_reminder,
+                func,
                 trigger=trigger,
-                args=[user_id, text, reminder_id, cron_expression],
+                args=args,
                 id=job_id,
                 replace_existing=True
             )
@@ -167,65 +253,28 @@ class SchedulerService:
         current_time = get_user_time(user_timezone)
         today = current_time.date()
         
-        messages = {
-            'year': "🎊 Год подходит к концу! Время подвести итоги года и поставить цели на следующий год.\n\nОтметьте выполненные задачи года и составьте новые!",
-            'month': "📅 Месяц подходит к концу! Время проанализировать достижения месяца.\n\nОтметьте выполненные задачи месяца и составьте новые!",
-            'week': "📊 Неделя завершается! Отличное время подвести итоги недели.\n\nОтметьте выполненные задачи недели и составьте новые!",
-            'day': "🌅 День подходит к концу! Время подвести итоги дня.\n\nОтметьте выполненные задачи дня и составьте новые!"
-        }
-        
         # Проверяем приоритеты
         if today.month == 12 and today.day == 31:
-            return "год", messages['year']
+            return SMART_REMINDER_MESSAGES['year']
         elif is_last_day_of_month(current_time):
-            return "месяц", messages['month']
+            return SMART_REMINDER_MESSAGES['month']
         elif today.weekday() == 6:  # воскресенье
-            return "неделя", messages['week']
+            return SMART_REMINDER_MESSAGES['week']
         else:
-            return "день", messages['day']
+            return SMART_REMINDER_MESSAGES['day']
 
-    async def _wrapped_send_recurring_reminder(self, user_id: int, text: str, reminder_id: int, cron_expression: str):
-        """
-        Обертка для отправки повторяющихся напоминаний.
-        Теперь определяет тип напоминания по приоритету.
-        """
-        try:
-            # Получаем данные пользователя и напоминания одним запросом
-            async with db.pool.acquire() as conn:
-                user_reminder_data = await conn.fetchrow("""
-                    SELECT u.timezone, r.is_built_in
-                    FROM users u
-                    JOIN reminders r ON r.reminder_id = $1
-                    WHERE u.user_id = $2
-                """, reminder_id, user_id)
-                
-            if not user_reminder_data:
-                logger.error(f"User {user_id} or reminder {reminder_id} not found")
-                return
-                
-            if user_reminder_data['is_built_in']:
-                # Для встроенного напоминания определяем приоритет
-                period_type, smart_message = self._get_reminder_message_by_priority(user_reminder_data['timezone'])
-                await self.send_reminder(user_id, smart_message, reminder_id, 'recurring')
-                logger.info(f"Sent smart {period_type} reminder to user {user_id}")
-            else:
-                # Для обычных напоминаний с L проверяем последний день месяца
-                if "L" in cron_expression:
-                    current_time = get_user_time(user_reminder_data['timezone'])
-                    if not is_last_day_of_month(current_time):
-                        return  # пропускаем не последний день месяца
-                
-                await self.send_reminder(user_id, text, reminder_id, 'recurring')
-                
-        except Exception as e:
-            logger.error(f"Error in wrapped recurring reminder {reminder_id}: {e}")
+    async def _send_smart_recurring_reminder(self, user_id: int, reminder_id: int, user_timezone: str):
+        """Отправка встроенного напоминания с текстом по приоритету периода"""
+        period_type, smart_message = self._get_reminder_message_by_priority(user_timezone)
+        await self.send_reminder(user_id, smart_message, reminder_id, 'recurring')
+        logger.info(f"Sent smart {period_type} reminder to user {user_id}")
 
     async def add_once_reminder(self, reminder_id: int, user_id: int, text: str, trigger_time: datetime):
         """Добавление разового напоминания"""
         try:
             job_id = f"reminder_once_{reminder_id}"
-            scheduler_tz = pytz.timezone(get_scheduler_timezone())
-            aware_trigger_time = scheduler_tz.localize(trigger_time)
+            scheduler_tz = get_zoneinfo(get_scheduler_timezone())
+            aware_trigger_time = trigger_time.replace(tzinfo=scheduler_tz)
 
             self.scheduler.add_job(
                 self.send_reminder,
@@ -244,76 +293,125 @@ class SchedulerService:
         """Удаление напоминания"""
         try:
             job_id = f"reminder_{reminder_type}_{reminder_id}"
-            if self.scheduler.get_job(job_id):
-                self.scheduler.remove_job(job_id)
-                logger.info(f"Removed {reminder_type} reminder {reminder_id}")
+            self.scheduler.remove_job(job_id)
+            logger.info(f"Removed {reminder_type} reminder {reminder_id}")
+
+        except JobLookupError:
+            # Задачи уже нет (например, разовое напоминание уже сработало)
+            pass
 
         except Exception as e:
             logger.error(f"Error removing reminder: {e}")
 
     async def send_reminder(self, user_id: int, text: str, reminder_id: int, reminder_type: str):
         """Отправка напоминания пользователю"""
-        try:
-            message = f"⏰ Напоминание:\n\n{text}"
-            await self.bot.send_message(user_id, message)
-
-            if reminder_type == 'once':
-                async with db.pool.acquire() as conn:
-                    await conn.execute(
-                        "DELETE FROM reminders WHERE reminder_id = $1",
-                        reminder_id
-                    )
-                logger.info(f"Deleted once reminder {reminder_id}")
+        await self.bot.send_message(user_id, REMINDER_MESSAGE_PREFIX + text)
+
+        if reminder_type == 'once':
+            # Удаляется пакетом в _flush_once_reminder_deletes
+            self._queue_once_reminder_delete({reminder_id})
+
+    async def reschedule_user_jobs(self, user_id: int):
+        """Пересоздание задач напоминаний пользователя (после смены часового пояса)"""
+        await self.load_active_reminders(user_id)
+
+    def _queue_once_reminder_delete(self, reminder_ids: set):
+        """
+        Постановка разовых напоминаний в очередь на удаление
+        
+        Разовая задача сброса создается только при появлении первого id в пустой очереди,
+        поэтому без сработавших напоминаний планировщик не выполняет лишних задач
+        """
+        was_empty = not self._pending_once_deletes
+        self._pending_once_deletes |= reminder_ids
+        if was_empty:
+            self.scheduler.add_job(
+                self._flush_once_reminder_deletes,
+                trigger=DateTrigger(run_date=datetime.now(self.scheduler.timezone) + timedelta(seconds=ONCE_REMINDER_DELETE_INTERVAL)),
+                id="once_reminders_cleanup",
+                replace_existing=True
+            )
+
+    async def _flush_once_reminder_deletes(self):
+        """Пакетное удаление сработавших разовых напоминаний"""
+        if not self._pending_once_deletes:
+            return
 
+        reminder_ids, self._pending_once_deletes = self._pending_once_deletes, set()
+        try:
+            await db.execute("DELETE FROM reminders WHERE reminder_id = ANY($1::int[])", list(reminder_ids))
+            logger.info(f"Deleted {len(reminder_ids)} once reminders")
         except Exception as e:
-            logger.error(f"Error sending reminder: {e}")
+            # Возвращаем id в очередь, чтобы повторить при следующем сбросе
+            if self.scheduler.running:
+                self._queue_once_reminder_delete(reminder_ids)
+            else:
+                self._pending_once_deletes |= reminder_ids
+            logger.error(f"Error deleting once reminders: {e}")
 
     async def setup_user_system_tasks(self):
-        """Системные задачи для каждого пользователя с учетом их часового пояса"""
+        """Системные задачи для каждого часового пояса пользователей"""
         try:
-            async with db.pool.acquire() as conn:
-                users = await conn.fetch("SELECT user_id, timezone FROM users")
+            timezones = await db.fetch("SELECT DISTINCT timezone FROM users")
 
-            for user in users:
+            for row in timezones:
                 try:
-                    await self.create_user_system_tasks(user['user_id'], user['timezone'])
+                    self._ensure_timezone_jobs(row['timezone'])
                 except Exception as e:
-                    logger.error(f"Error creating system tasks for user {user['user_id']}: {e}")
+                    logger.error(f"Error creating system tasks for timezone {row['timezone']}: {e}")
 
-            # Глобальная задача бэкапа остается в UTC
+            # Глобальная проверка просроченных задач: дедлайны хранятся в UTC,
+            # поэтому достаточно одного запроса по всем пользователям каждые 15 минут
             self.scheduler.add_job(
-                self.send_daily_backup,
+                self.check_overdue_tasks,
+                trigger=CronTrigger(minute="*/15"),
+                id="overdue_check",
+                replace_existing=True
+            )
+
+            # Глобальная задача бэкапа остается в UTC (ошибки обрабатывает сама send_daily_backup)
+            self.scheduler.add_job(
+                send_daily_backup,
                 trigger=CronTrigger(hour=12, minute=0),
+                args=[self.bot],
                 id="daily_backup",
                 replace_existing=True
             )
 
-            logger.info(f"System tasks setup completed for {len(users)} users")
+            logger.info(f"System tasks setup completed for {len(timezones)} timezones")
 
         except Exception as e:
             logger.error(f"Error setting up user system tasks: {e}")
 
+    def _ensure_timezone_jobs(self, timezone_str: str):
+        """Создает рассылки для часового пояса, если их еще нет"""
+        user_tz = get_zoneinfo(timezone_str)
+
+        timezone_jobs = [
+            # Мотивация генерируется заранее, чтобы рассылка в 8:00 не ждала OpenAI
+            ("motivation_prefetch", self.prefetch_daily_motivation, 7, 55),
+            ("daily_motivation", self.send_timezone_daily_motivation, 8, 0),
+            ("evening_review", self.send_timezone_evening_review, 23, 0)
+        ]
+
+        for job_type, func, hour, minute in timezone_jobs:
+            job_id = f"{job_type}_{timezone_str}"
+            if self.scheduler.get_job(job_id):
+                continue
+
+            self.scheduler.add_job(
+                func,
+                trigger=CronTrigger(hour=hour, minute=minute, timezone=user_tz),
+                args=[timezone_str],
+                id=job_id,
+                replace_existing=True
+            )
+
     async def create_user_system_tasks(self, user_id: int, timezone_str: str):
-        """Создает персональные системные задачи для пользователя"""
+        """Подключает пользователя к рассылкам его часового пояса"""
         try:
-            user_tz = pytz.timezone(timezone_str)
-            
-            user_tasks = [
-                ("daily_motivation", self.send_user_daily_motivation, CronTrigger(hour=8, minute=0, timezone=user_tz)),
-                ("evening_review", self.send_user_evening_review, CronTrigger(hour=23, minute=0, timezone=user_tz)),
-                ("overdue_check", self.check_user_overdue_tasks, CronTrigger(hour=0, minute=0, timezone=user_tz))
-            ]
-
-            for task_type, func, trigger in user_tasks:
-                job_id = f"{task_type}_{user_id}"
-                self.scheduler.add_job(
-                    func,
-                    trigger=trigger,
-                    args=[user_id],
-                    id=job_id,
-                    replace_existing=True
-                )
-
+            # Рассылки общие для часового пояса: задача выбирает пользователей при срабатывании
+            self._ensure_timezone_jobs(timezone_str)
             logger.info(f"Created system tasks for user {user_id} in timezone {timezone_str}")
 
         except Exception as e:
@@ -322,241 +420,207 @@ class SchedulerService:
     async def update_user_system_tasks(self, user_id: int, new_timezone: str):
         """Обновляет системные задачи пользователя при смене часового пояса"""
         try:
-            # Удаляем старые задачи
-            await self.remove_user_system_tasks(user_id)
-            
-            # Создаем новые с новым часовым поясом
+            # Из рассылок старого пояса пользователь выпадет сам: они читают timezone из users
             await self.create_user_system_tasks(user_id, new_timezone)
+
+            # Часовой пояс зашит в триггеры и аргументы задач напоминаний - пересоздаем их
+            await self.reschedule_user_jobs(user_id)
             
             logger.info(f"Updated system tasks for user {user_id} to timezone {new_timezone}")
 
         except Exception as e:
             logger.error(f"Error updating system tasks for user {user_id}: {e}")
 
-    async def remove_user_system_tasks(self, user_id: int):
-        """Удаляет все системные задачи пользователя"""
-        task_types = ["daily_motivation", "evening_review", "overdue_check"]
+    async def _broadcast(self, messages: dict, kind: str):
+        """
+        Параллельная рассылка сообщений {user_id: текст}
         
-        for task_type in task_types:
-            job_id = f"{task_type}_{user_id}"
-            try:
-                if self.scheduler.get_job(job_id):
-                    self.scheduler.remove_job(job_id)
-            except Exception as e:
-                logger.error(f"Error removing {task_type} task for user {user_id}: {e}")
-
-    async def send_user_daily_motivation(self, user_id: int):
-        """Утренняя мотивация для конкретного пользователя"""
-        try:
-            motivation = await generate_daily_motivation()
-            message = f"🌅 Доброе утро!\n\n{motivation}"
-            await self.bot.send_message(user_id, message)
-            
-        except Exception as e:
-            logger.error(f"Error sending daily motivation to user {user_id}: {e}")
-
-    async def send_user_evening_review(self, user_id: int):
-        """Вечернее ревью для конкретного пользователя"""
-        try:
-            # Используем существующий метод, который уже правильно работает с часовыми поясами
-            await self.send_user_evening_review_detailed(user_id)
-            
-        except Exception as e:
-            logger.error(f"Error sending evening review to user {user_id}: {e}")
+        Отправки идут не чаще BROADCAST_RATE в секунду (общий темп для всех рассылок),
+        а при ответе 429 повторяются после паузы, которую назвал Telegram
+        """
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+        async def _send(user_id: int, text: str):
+            async with semaphore:
+                for attempt in range(BROADCAST_MAX_RETRIES + 1):
+                    await self._wait_broadcast_slot()
+                    try:
+                        await self.bot.send_message(user_id, text)
+                        return
+                    except TelegramRetryAfter as e:
+                        if attempt == BROADCAST_MAX_RETRIES:
+                            logger.error(f"Error sending {kind} to user {user_id}: {e}")
+                            return
+                        logger.warning(f"Flood limit while sending {kind}, retrying in {e.retry_after} s")
+                        # Пауза распространяется на все отправки, а не только на эту
+                        self._delay_broadcasts(e.retry_after)
+                    except Exception as e:
+                        logger.error(f"Error sending {kind} to user {user_id}: {e}")
+                        return
+
+        await asyncio.gather(*(_send(user_id, text) for user_id, text in messages.items()))
+
+    async def _wait_broadcast_slot(self):
+        """Ожидание очередного слота отправки при темпе BROADCAST_RATE сообщений в секунду"""
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_broadcast_slot)
+        self._next_broadcast_slot = slot + 1 / BROADCAST_RATE
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _delay_broadcasts(self, seconds: float):
+        """Сдвиг следующего слота отправки после ответа 429"""
+        resume_at = asyncio.get_running_loop().time() + seconds
+        self._next_broadcast_slot = max(self._next_broadcast_slot, resume_at)
+
+    async def prefetch_daily_motivation(self, timezone_str: str):
+        """Заранее получает мотивацию дня (сообщение кэшируется в openai_service)"""
+        await generate_daily_motivation()
+        logger.debug(f"Prefetched daily motivation for timezone {timezone_str}")
+
+    async def send_timezone_daily_motivation(self, timezone_str: str):
+        """Утренняя мотивация всем пользователям часового пояса"""
+        users = await db.fetch("SELECT user_id FROM users WHERE timezone = $1", timezone_str)
+        if not users:
+            return
+
+        motivation = await generate_daily_motivation()
+        message = MOTIVATION_MESSAGE_PREFIX + motivation
+        await self._broadcast({user['user_id']: message for user in users}, "daily motivation")
+
+    async def send_timezone_evening_review(self, timezone_str: str):
+        """Формирует и отправляет ревью дня всем пользователям часового пояса"""
+        # Границы дня одинаковы для всех пользователей часового пояса
+        current_time = get_user_time(timezone_str)
+        today = current_time.date()
+        yesterday = today - timedelta(days=1)
+        
+        today_utc_start, today_utc_end = self._get_day_utc_bounds(today, timezone_str)
+        yesterday_utc_start, yesterday_utc_end = self._get_day_utc_bounds(yesterday, timezone_str)
+
+        users = await db.fetch("SELECT user_id FROM users WHERE timezone = $1", timezone_str)
+        if not users:
+            return
+        user_ids = [user['user_id'] for user in users]
+
+        # Записи дневника и релевантные задачи всех пользователей часового пояса - одним запросом,
+        # строки различаются по kind. Задачи выбираются отдельной веткой на каждый статус,
+        # чтобы каждая ветка шла по индексу (user_id, status), а не одним OR по всей таблице
+        rows = await db.fetch(
+            """SELECT 'diary' AS kind, user_id, content AS text, created_at,
+                      NULL::varchar AS status, NULL::varchar AS category
+               FROM diary_entries
+               WHERE user_id = ANY($1::bigint[]) AND entry_date = $2
+               UNION ALL
+               SELECT 'task', user_id, text, NULL, status, category FROM tasks
+               WHERE user_id = ANY($1::bigint[]) AND status = 'completed'
+                 AND completed_at >= $3 AND completed_at <= $4
+               UNION ALL
+               SELECT 'task', user_id, text, NULL, status, category FROM tasks
+               WHERE user_id = ANY($1::bigint[]) AND status = 'failed'
+                 AND completed_at >= $3 AND completed_at <= $4
+               UNION ALL
+               SELECT 'task', user_id, text, NULL, status, category FROM tasks
+               WHERE user_id = ANY($1::bigint[]) AND status = 'active'
+                 AND deadline >= $3 AND deadline <= $4
+               UNION ALL
+               SELECT 'task', user_id, text, NULL, status, category FROM tasks
+               WHERE user_id = ANY($1::bigint[]) AND status = 'overdue'
+                 AND deadline >= $5 AND deadline <= $6
+               ORDER BY kind, status, category NULLS LAST, created_at""",
+            user_ids, today, today_utc_start, today_utc_end, yesterday_utc_start, yesterday_utc_end
+        )
 
-    async def send_user_evening_review_detailed(self, user_id: int):
-        """Формирует и отправляет ревью дня конкретному пользователю с расшифровкой данных"""
-        try:
-            async with db.pool.acquire() as conn:
-                user = await conn.fetchrow("SELECT timezone FROM users WHERE user_id = $1", user_id)
-                if not user:
-                    logger.error(f"User {user_id} not found")
-                    return
-
-            current_time = get_user_time(user['timezone'])
-            today = current_time.date()
-            yesterday = today - timedelta(days=1)
-            
-            today_utc_start, today_utc_end = self._get_day_utc_bounds(today, user['timezone'])
-            yesterday_utc_start, yesterday_utc_end = self._get_day_utc_bounds(yesterday, user['timezone'])
-
-            # Получаем данные одним блоком запросов
-            async with db.pool.acquire() as conn:
-                # Записи дневника
-                diary_entries = await conn.fetch(
-                    """SELECT content, created_at FROM diary_entries 
-                       WHERE user_id = $1 AND entry_date = $2
-                       ORDER BY created_at ASC""",
-                    user_id, today
+        # Расшифровываем тексты всего часового пояса одним пакетом вне event loop
+        texts = await decrypt_texts_async([row['text'] for row in rows], on_error=DECRYPTION_ERROR_TEXT)
+
+        # Раскладываем строки по пользователям
+        diary_by_user = defaultdict(list)
+        tasks_by_user = defaultdict(list)
+        for row, text in zip(rows, texts):
+            if row['kind'] == 'diary':
+                if text is DECRYPTION_ERROR_TEXT:
+                    logger.error(f"Failed to decrypt diary entry for user {row['user_id']}")
+                diary_by_user[row['user_id']].append((row['created_at'], text))
+            else:
+                if text is DECRYPTION_ERROR_TEXT:
+                    logger.error(f"Failed to decrypt task for user {row['user_id']}")
+                tasks_by_user[row['user_id']].append((row['status'], text, row['category']))
+
+        messages = {}
+        for user_id in user_ids:
+            # Пустое ревью (нет ни записей, ни задач) не отправляем
+            if SKIP_EMPTY_EVENING_REVIEW and not diary_by_user[user_id] and not tasks_by_user[user_id]:
+                continue
+            try:
+                messages[user_id] = self._format_evening_review(
+                    today, diary_by_user[user_id], tasks_by_user[user_id]
                 )
+            except Exception as e:
+                logger.error(f"Error sending evening review to user {user_id}: {e}")
 
-                # Релевантные задачи для ревью
-                review_tasks = await conn.fetch(
-                    """SELECT text, category, status, deadline, completed_at FROM tasks 
-                       WHERE user_id = $1 AND (
-                           (status = 'completed' AND completed_at >= $2 AND completed_at <= $3)
-                           OR (status = 'failed' AND completed_at >= $2 AND completed_at <= $3)
-                           OR (status = 'active' AND deadline IS NOT NULL AND deadline >= $2 AND deadline <= $3)
-                           OR (status = 'overdue' AND deadline IS NOT NULL AND deadline >= $4 AND deadline <= $5)
-                       )
-                       ORDER BY status, category NULLS LAST""",
-                    user_id, today_utc_start, today_utc_end, yesterday_utc_start, yesterday_utc_end
-                )
+        await self._broadcast(messages, "evening review")
 
-            # Формируем сообщение
-            review_text = f"🌙 Ревью дня {today.strftime('%d.%m.%Y')}\n\n"
-
-            # Записи дневника с расшифровкой
-            if diary_entries:
-                review_text += "📝 Записи дневника:\n"
-                for entry in diary_entries:
-                    time_str = entry['created_at'].strftime('%H:%M')
-                    decrypted_content = self._decrypt_content_safely(entry['content'], 'diary entry', user_id)
-                    # Обрезаем длинные записи
-                    content = decrypted_content[:150] + ('...' if len(decrypted_content) > 150 else '')
-                    review_text += f"• {time_str} - {content}\n"
-                review_text += "\n"
-            else:
-                review_text += "📝 Записей дневника за день нет\n\n"
+        logger.info(f"Sent evening review to {len(messages)} of {len(user_ids)} users in timezone {timezone_str}")
 
-            # Задачи для ревью с расшифровкой и группировкой
-            if review_tasks:
-                review_text += "📋 Задачи:\n"
-                task_groups = self._group_tasks_by_status(review_tasks, user_id)
-                
-                # Форматируем каждую группу задач
-                review_text += self._format_task_group(task_groups['completed'], "Выполнено сегодня", "✅")
-                review_text += self._format_task_group(task_groups['failed'], "Отмечено невыполненными сегодня", "❌")
-                review_text += self._format_task_group(task_groups['active'], "Активные с дедлайном сегодня", "🔥")
-                review_text += self._format_task_group(task_groups['overdue'], "Стали просроченными сегодня", "⚠️")
-            else:
-                review_text += "📋 Релевантных задач за день нет\n\n"
+    def _format_evening_review(self, today, diary_entries: list, review_tasks: list) -> str:
+        """
+        Формирует текст ревью дня пользователя из уже расшифрованных данных
+        
+        diary_entries - пары (created_at, текст), review_tasks - тройки (статус, текст, категория)
+        """
+        parts = [f"🌙 Ревью дня {today.strftime('%d.%m.%Y')}\n\n"]
+
+        # Записи дневника
+        if diary_entries:
+            parts.append("📝 Записи дневника:\n")
+            for created_at, content in diary_entries:
+                time_str = created_at.strftime('%H:%M')
+                # Обрезаем длинные записи
+                content = content[:150] + ('...' if len(content) > 150 else '')
+                parts.append(f"• {time_str} - {content}\n")
+            parts.append("\n")
+        else:
+            parts.append("📝 Записей дневника за день нет\n\n")
 
-            review_text += "Хорошего отдыха!"
+        # Задачи для ревью с группировкой
+        if review_tasks:
+            parts.append("📋 Задачи:\n")
+            task_groups = self._group_tasks_by_status(review_tasks)
+            
+            # Форматируем каждую группу задач
+            parts.append(self._format_task_group(task_groups['completed'], "Выполнено сегодня", "✅"))
+            parts.append(self._format_task_group(task_groups['failed'], "Отмечено невыполненными сегодня", "❌"))
+            parts.append(self._format_task_group(task_groups['active'], "Активные с дедлайном сегодня", "🔥"))
+            parts.append(self._format_task_group(task_groups['overdue'], "Стали просроченными сегодня", "⚠️"))
+        else:
+            parts.append("📋 Релевантных задач за день нет\n\n")
 
-            # Отправляем сообщение
-            await self.bot.send_message(user_id, review_text)
+        parts.append("Хорошего отдыха!")
+        return "".join(parts)
 
-        except Exception as e:
-            logger.error(f"Error sending evening review to user {user_id}: {e}")
-
-    async def check_user_overdue_tasks(self, user_id: int):
-        """Проверка и пометка просроченных задач для конкретного пользователя"""
-        TASK_LIMITS = {
-            'active': 50,
-            'completed': 50,
-            'failed': 25,
-            'overdue': 25
-        }
+    async def check_overdue_tasks(self):
+        """Пометка просроченных задач всех пользователей set-based запросами"""
+        marked_count, trimmed_user_ids = await db.mark_overdue_tasks(TASK_LIMITS['overdue'])
         
-        try:
-            # Получаем данные пользователя
-            async with db.pool.acquire() as conn:
-                user = await conn.fetchrow("SELECT timezone FROM users WHERE user_id = $1", user_id)
-                
-            if not user:
-                logger.error(f"User {user_id} not found")
-                return
+        # Очистка неиспользуемых категорий у пользователей, чьи задачи были удалены
+        if trimmed_user_ids:
+            await self._cleanup_unused_categories(trimmed_user_ids)
 
-            user_tz = pytz.timezone(user['timezone'])
-            current_time = get_user_time(user['timezone'])
-            current_utc = self._normalize_datetime_for_db(current_time)
-            
-            # Выполняем все операции в рамках одной транзакции для атомарности
-            async with db.pool.acquire() as conn:
-                async with conn.transaction():
-                    # Получаем просроченные задачи с блокировкой
-                    overdue_tasks = await conn.fetch(
-                        """SELECT task_id FROM tasks 
-                        WHERE user_id = $1 AND status = 'active' 
-                        AND deadline IS NOT NULL AND deadline < $2
-                        FOR UPDATE SKIP LOCKED""",  # Пропускаем заблокированные записи
-                        user_id, current_utc
-                    )
-                    
-                    if overdue_tasks:
-                        # Считаем текущее количество просроченных задач
-                        overdue_count = await conn.fetchval(
-                            "SELECT COUNT(*) FROM tasks WHERE user_id = $1 AND status = 'overdue'",
-                            user_id
-                        )
-                        
-                        tasks_to_mark = len(overdue_tasks)
-                        
-                        # Если превышаем лимит, удаляем самые старые просроченные
-                        if overdue_count + tasks_to_mark > TASK_LIMITS['overdue']:
-                            delete_count = (overdue_count + tasks_to_mark) - TASK_LIMITS['overdue']
-                            await conn.execute(
-                                """DELETE FROM tasks WHERE task_id IN (
-                                    SELECT task_id FROM tasks 
-                                    WHERE user_id = $1 AND status = 'overdue'
-                                    ORDER BY marked_overdue_at ASC LIMIT $2
-                                )""",
-                                user_id, delete_count
-                            )
-                        
-                        # Помечаем задачи как просроченные
-                        task_ids = [task['task_id'] for task in overdue_tasks]
-                        await conn.execute(
-                            """UPDATE tasks SET status = 'overdue', marked_overdue_at = NOW() 
-                            WHERE task_id = ANY($1::int[])""",
-                            task_ids
-                        )
-                        
-                        logger.info(f"Marked {len(task_ids)} tasks as overdue for user {user_id}")
-                    
-                    # ДОБАВЛЯЕМ: Очистка неиспользуемых категорий после изменения статусов задач
-                    await self._cleanup_unused_categories_for_user(user_id, conn)
-        
-        except asyncpg.InterfaceError as e:
-            if "another operation is in progress" in str(e).lower():
-                # Логируем и пропускаем, задача выполнится в следующий раз
-                logger.warning(f"Skipping overdue check for user {user_id}: database busy")
-            else:
-                logger.error(f"Interface error checking overdue tasks for user {user_id}: {e}")
-        except Exception as e:
-            logger.error(f"Error checking overdue tasks for user {user_id}: {e}")
+        if marked_count:
+            logger.info(f"Marked {marked_count} tasks as overdue")
 
-    async def _cleanup_unused_categories_for_user(self, user_id: int, conn=None):
-        """Удаляет неиспользуемые категории задач для пользователя"""
-        try:
-            logger.debug(f"Checking unused categories for user {user_id}")
-            
-            # Используем переданное соединение или создаем новое
-            if conn is None:
-                async with db.pool.acquire() as conn:
-                    await self._perform_category_cleanup(user_id, conn)
-            else:
-                await self._perform_category_cleanup(user_id, conn)
-                
-        except Exception as e:
-            logger.error(f"Error cleaning up unused categories for user {user_id}: {e}")
-
-    async def _perform_category_cleanup(self, user_id: int, conn):
-        """Выполняет очистку категорий для пользователя"""
-        # Находим категории, которые не используются ни в одной задаче
-        unused_categories = await conn.fetch(
-            """SELECT tc.category_id, tc.name 
-            FROM task_categories tc
-            LEFT JOIN tasks t ON tc.name = t.category AND tc.user_id = t.user_id
-            WHERE tc.user_id = $1 AND t.task_id IS NULL""",
-            user_id
-        )
+    async def _cleanup_unused_categories(self, user_ids: list = None):
+        """Удаляет неиспользуемые категории задач одним запросом (None - у всех пользователей)"""
+        deleted = await db.delete_unused_categories(user_ids)
         
-        logger.debug(f"Found {len(unused_categories)} unused categories for user {user_id}")
+        deleted_by_user = defaultdict(list)
+        for category in deleted:
+            deleted_by_user[category['user_id']].append(category['name'])
+        for user_id, category_names in deleted_by_user.items():
+            logger.info(f"Cleaned up {len(category_names)} unused categories for user {user_id}: {category_names}")
         
-        if unused_categories:
-            # Удаляем неиспользуемые категории
-            category_ids = [cat['category_id'] for cat in unused_categories]
-            await conn.execute(
-                "DELETE FROM task_categories WHERE category_id = ANY($1::int[])",
-                category_ids
-            )
-            
-            category_names = [cat['name'] for cat in unused_categories]
-            logger.info(f"Cleaned up {len(category_ids)} unused categories for user {user_id}: {category_names}")
-        else:
-            logger.debug(f"No unused categories found for user {user_id}")
+        return deleted
 
     # Также добавим глобальную функцию очистки всех категорий, которую можно вызывать отдельно
     async def cleanup_all_unused_categories(self):
@@ -564,32 +628,15 @@ class SchedulerService:
         try:
             logger.info("Starting global category cleanup...")
             
-            async with db.pool.acquire() as conn:
-                # Получаем всех пользователей, у которых есть категории
-                users = await conn.fetch(
-                    "SELECT DISTINCT user_id FROM task_categories"
-                )
-                
-            logger.info(f"Found {len(users)} users with categories to check")
-            
-            for user in users:
-                await self._cleanup_unused_categories_for_user(user['user_id'])
+            deleted = await self._cleanup_unused_categories()
                 
-            logger.info("Global category cleanup completed")
+            logger.info(f"Global category cleanup completed, removed {len(deleted)} categories")
                 
         except Exception as e:
             logger.error(f"Error in global category cleanup: {e}")
 
-    def _decrypt_content_safely(self, content: str, content_type: str, user_id: int) -> str:
-        """Безопасная расшифровка контента с обработкой ошибок"""
-        try:
-            return decrypt_text(content)
-        except Exception as e:
-            logger.error(f"Failed to decrypt {content_type} for user {user_id}: {e}")
-            return "[Ошибка расшифровки]"
-
-    def _group_tasks_by_status(self, tasks: list, user_id: int) -> dict:
-        """Группировка задач по статусам с расшифровкой"""
+    def _group_tasks_by_status(self, tasks: list) -> dict:
+        """Группировка задач (статус, текст, категория) по статусам в пары (текст, категория)"""
         groups = {
             'completed': [],
             'failed': [],
@@ -597,13 +644,9 @@ class SchedulerService:
             'overdue': []
         }
         
-        for task in tasks:
-            decrypted_text = self._decrypt_content_safely(task['text'], 'task', user_id)
-            task_dict = dict(task)
-            task_dict['text'] = decrypted_text
-            
-            if task['status'] in groups:
-                groups[task['status']].append(task_dict)
+        for status, text, category in tasks:
+            if status in groups:
+                groups[status].append((text, category))
         
         return groups
 
@@ -612,48 +655,27 @@ class SchedulerService:
         if not tasks:
             return ""
         
-        result = f"{icon} {title}:\n"
-        for task in tasks:
-            category_text = f" ({task['category']})" if task['category'] else ""
-            result += f"  • {task['text']}{category_text}\n"
-        result += "\n"
-        return result
+        lines = [f"{icon} {title}:"]
+        for text, category in tasks:
+            category_text = f" ({category})" if category else ""
+            lines.append(f"  • {text}{category_text}")
+        return "\n".join(lines) + "\n\n"
 
     def _get_day_utc_bounds(self, date, timezone_str):
         """Получает UTC границы дня для заданной даты в часовом поясе пользователя"""
-        user_tz = pytz.timezone(timezone_str)
+        user_tz = get_zoneinfo(timezone_str)
+        utc = get_zoneinfo("UTC")
         
         # Начало и конец дня в пользовательском часовом поясе
-        day_start_local = user_tz.localize(datetime.combine(date, time.min))
-        day_end_local = user_tz.localize(datetime.combine(date, time.max))
+        day_start_local = datetime.combine(date, time.min, tzinfo=user_tz)
+        day_end_local = datetime.combine(date, time.max, tzinfo=user_tz)
         
         # Конвертируем в UTC и убираем timezone info для БД
-        day_start_utc = day_start_local.astimezone(pytz.UTC).replace(tzinfo=None)
-        day_end_utc = day_end_local.astimezone(pytz.UTC).replace(tzinfo=None)
+        day_start_utc = day_start_local.astimezone(utc).replace(tzinfo=None)
+        day_end_utc = day_end_local.astimezone(utc).replace(tzinfo=None)
         
         return day_start_utc, day_end_utc
 
-    def _normalize_datetime_for_db(self, dt):
-        """Нормализует datetime для сохранения в базу данных"""
-        if dt is None:
-            return None
-        
-        # Если datetime содержит timezone info, конвертируем в UTC и убираем timezone info
-        if dt.tzinfo is not None:
-            utc_dt = dt.astimezone(pytz.UTC)
-            return utc_dt.replace(tzinfo=None)
-        
-        # Если уже naive, возвращаем как есть
-        return dt
-
-    async def send_daily_backup(self):
-        """Ежедневная отправка бэкапа админу в 12:00 UTC"""
-        try:
-            await send_daily_backup(self.bot)
-            logger.info("Daily backup task completed")
-        except Exception as e:
-            logger.error(f"Error in daily backup task: {e}")
-
     # Методы для управления пользователями (новые пользователи, смена часового пояса)
     async def add_new_user_system_tasks(self, user_id: int, timezone_str: str):
         """Добавляет системные задачи для нового пользователя"""
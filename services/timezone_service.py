@@ -1,49 +1,185 @@
-import pytz
+import logging
+import math
 import os
-from geopy.geocoders import Nominatim
+import time
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
+from zoneinfo import ZoneInfo, available_timezones
 
-async def get_timezone_from_location(latitude: float, longitude: float) -> str:
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=512)
+def get_zoneinfo(timezone_str: str) -> ZoneInfo:
+    """Возвращает часовой пояс zoneinfo по имени (с кэшированием)"""
+    return ZoneInfo(timezone_str)
+
+# Старое имя: часовые пояса теперь везде zoneinfo
+get_timezone = get_zoneinfo
+
+# Опорные точки (широта, долгота) крупных городов для определения часового пояса по координатам
+_TIMEZONE_CENTROIDS = (
+    ("Europe/London", 51.51, -0.13),
+    ("Europe/Lisbon", 38.72, -9.14),
+    ("Europe/Madrid", 40.42, -3.70),
+    ("Europe/Paris", 48.86, 2.35),
+    ("Europe/Berlin", 52.52, 13.40),
+    ("Europe/Rome", 41.90, 12.50),
+    ("Europe/Warsaw", 52.23, 21.01),
+    ("Europe/Stockholm", 59.33, 18.07),
+    ("Europe/Helsinki", 60.17, 24.94),
+    ("Europe/Kiev", 50.45, 30.52),
+    ("Europe/Kiev", 49.99, 36.23),  # Харьков
+    ("Europe/Minsk", 53.90, 27.57),
+    ("Europe/Minsk", 52.44, 30.98),  # Гомель
+    ("Europe/Riga", 56.95, 24.11),
+    ("Europe/Vilnius", 54.69, 25.28),
+    ("Europe/Tallinn", 59.44, 24.75),
+    ("Europe/Istanbul", 41.01, 28.98),
+    ("Europe/Kaliningrad", 54.71, 20.51),
+    ("Europe/Moscow", 55.76, 37.62),
+    # Крупные города часового пояса Москвы у его границ, иначе ближе оказываются
+    # опорные точки соседних поясов (Хельсинки, Самара, Тбилиси)
+    ("Europe/Moscow", 59.94, 30.31),  # Санкт-Петербург
+    ("Europe/Moscow", 68.97, 33.07),  # Мурманск
+    ("Europe/Moscow", 64.54, 40.54),  # Архангельск
+    ("Europe/Moscow", 56.33, 44.00),  # Нижний Новгород
+    ("Europe/Moscow", 55.79, 49.12),  # Казань
+    ("Europe/Moscow", 47.24, 39.71),  # Ростов-на-Дону
+    ("Europe/Moscow", 45.04, 38.98),  # Краснодар
+    ("Europe/Moscow", 51.67, 39.18),  # Воронеж
+    ("Europe/Moscow", 50.60, 36.59),  # Белгород
+    ("Europe/Moscow", 51.73, 36.19),  # Курск
+    ("Europe/Moscow", 53.24, 34.37),  # Брянск
+    ("Europe/Moscow", 54.78, 32.05),  # Смоленск
+    ("Europe/Moscow", 53.20, 45.00),  # Пенза
+    ("Europe/Kirov", 58.60, 49.66),
+    ("Europe/Volgograd", 48.71, 44.51),
+    ("Europe/Saratov", 51.53, 46.03),
+    ("Europe/Ulyanovsk", 54.31, 48.40),
+    ("Europe/Astrakhan", 46.35, 48.04),
+    ("Europe/Samara", 53.20, 50.15),
+    ("Europe/Samara", 56.85, 53.20),  # Ижевск
+    ("Asia/Yekaterinburg", 56.84, 60.61),
+    ("Asia/Yekaterinburg", 54.74, 55.97),  # Уфа
+    ("Asia/Yekaterinburg", 58.01, 56.25),  # Пермь
+    ("Asia/Yekaterinburg", 51.77, 55.10),  # Оренбург
+    ("Asia/Omsk", 54.99, 73.37),
+    ("Asia/Novosibirsk", 55.01, 82.93),
+    ("Asia/Krasnoyarsk", 56.01, 92.87),
+    ("Asia/Irkutsk", 52.29, 104.28),
+    ("Asia/Yakutsk", 62.03, 129.73),
+    ("Asia/Vladivostok", 43.12, 131.89),
+    ("Asia/Magadan", 59.56, 150.80),
+    ("Asia/Kamchatka", 53.02, 158.65),
+    ("Asia/Tbilisi", 41.72, 44.79),
+    ("Asia/Yerevan", 40.18, 44.51),
+    ("Asia/Baku", 40.41, 49.87),
+    ("Asia/Tashkent", 41.30, 69.24),
+    ("Asia/Almaty", 43.24, 76.89),
+    ("Asia/Almaty", 51.17, 71.43),  # Астана
+    ("Asia/Aqtobe", 50.28, 57.17),
+    ("Asia/Atyrau", 47.11, 51.92),
+    ("Asia/Oral", 51.23, 51.37),
+    ("Asia/Dubai", 25.20, 55.27),
+    ("Asia/Tehran", 35.69, 51.39),
+    ("Asia/Kolkata", 28.61, 77.21),
+    ("Asia/Bangkok", 13.76, 100.50),
+    ("Asia/Shanghai", 39.90, 116.41),
+    ("Asia/Singapore", 1.35, 103.82),
+    ("Asia/Seoul", 37.57, 126.98),
+    ("Asia/Tokyo", 35.68, 139.69),
+    ("Australia/Perth", -31.95, 115.86),
+    ("Australia/Adelaide", -34.93, 138.60),
+    ("Australia/Sydney", -33.87, 151.21),
+    ("Pacific/Auckland", -36.85, 174.76),
+    ("Africa/Cairo", 30.04, 31.24),
+    ("Africa/Lagos", 6.52, 3.38),
+    ("Africa/Nairobi", -1.29, 36.82),
+    ("Africa/Johannesburg", -26.20, 28.05),
+    ("America/New_York", 40.71, -74.01),
+    ("America/Chicago", 41.88, -87.63),
+    ("America/Denver", 39.74, -104.99),
+    ("America/Los_Angeles", 34.05, -118.24),
+    ("America/Anchorage", 61.22, -149.90),
+    ("America/Mexico_City", 19.43, -99.13),
+    ("America/Bogota", 4.71, -74.07),
+    ("America/Sao_Paulo", -23.55, -46.63),
+    ("America/Argentina/Buenos_Aires", -34.60, -58.38),
+    ("Pacific/Honolulu", 21.31, -157.86),
+)
+
+def _to_unit_vector(latitude: float, longitude: float) -> tuple:
+    """Переводит географические координаты в точку на единичной сфере"""
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+# Точки на единичной сфере считаются один раз при импорте
+_TIMEZONE_POINTS = tuple(
+    (name, _to_unit_vector(latitude, longitude)) for name, latitude, longitude in _TIMEZONE_CENTROIDS
+)
+
+def get_timezone_from_location(latitude: float, longitude: float) -> str:
     """
     Определяет часовой пояс по координатам
-    Простая реализация - в реальном проекте лучше использовать специальный сервис
+    Приближенная реализация: берется часовой пояс ближайшего крупного города
     """
     try:
-        # Для упрощения используем приблизительное определение по координатам
-        # В реальном проекте лучше использовать API типа TimeZoneDB
+        x, y, z = _to_unit_vector(latitude, longitude)
         
-        if 55 <= latitude <= 70 and 37 <= longitude <= 170:
-            return "Europe/Moscow"
-        elif 40 <= latitude <= 52 and 22 <= longitude <= 40:
-            return "Europe/Kiev"
-        elif 43 <= latitude <= 55 and 51 <= longitude <= 87:
-            return "Asia/Almaty"
-        elif 49 <= latitude <= 61 and -8 <= longitude <= 2:
-            return "Europe/London"
-        elif 47 <= latitude <= 55 and 6 <= longitude <= 15:
-            return "Europe/Berlin"
-        elif 25 <= latitude <= 49 and -125 <= longitude <= -66:
-            return "America/New_York"
-        elif 32 <= latitude <= 49 and -125 <= longitude <= -114:
-            return "America/Los_Angeles"
-        elif 24 <= latitude <= 46 and 123 <= longitude <= 146:
-            return "Asia/Tokyo"
-        elif -44 <= latitude <= -10 and 113 <= longitude <= 154:
-            return "Australia/Sydney"
-        else:
-            return "UTC"
+        # Ближайшая точка на сфере - с максимальным скалярным произведением
+        name, _ = max(
+            _TIMEZONE_POINTS,
+            key=lambda point: point[1][0] * x + point[1][1] * y + point[1][2] * z
+        )
+        return name
     
     except Exception:
         return "UTC"
 
+# Контрольные точки: города у границ поясов, где ближайшая опорная точка легко оказывается чужой
+_LOCATION_SPOT_CHECKS = (
+    (59.94, 30.31, "Europe/Moscow"),  # Санкт-Петербург
+    (68.97, 33.07, "Europe/Moscow"),  # Мурманск
+    (64.54, 40.54, "Europe/Moscow"),  # Архангельск
+    (55.79, 49.12, "Europe/Moscow"),  # Казань
+    (47.24, 39.71, "Europe/Moscow"),  # Ростов-на-Дону
+    (45.04, 38.98, "Europe/Moscow"),  # Краснодар
+    (48.71, 44.51, "Europe/Volgograd"),
+    (54.71, 20.51, "Europe/Kaliningrad"),
+    (53.20, 50.15, "Europe/Samara"),
+    (54.74, 55.97, "Asia/Yekaterinburg"),  # Уфа
+    (51.17, 71.43, "Asia/Almaty"),  # Астана
+    (60.17, 24.94, "Europe/Helsinki"),
+    (49.99, 36.23, "Europe/Kiev"),  # Харьков
+    (41.72, 44.79, "Asia/Tbilisi"),
+)
+for _latitude, _longitude, _expected in _LOCATION_SPOT_CHECKS:
+    assert get_timezone_from_location(_latitude, _longitude) == _expected, (_latitude, _longitude, _expected)
+
+# Последнее вычисленное текущее время по часовым поясам: пояс -> (секунда эпохи, время)
+_user_time_cache = {}
+
 def get_user_time(timezone_str: str) -> datetime:
-    """Получает текущее время в часовом поясе пользователя"""
+    """
+    Получает текущее время в часовом поясе пользователя
+    
+    Время нужно с точностью до секунды, поэтому в пределах одной секунды
+    для одного пояса возвращается уже вычисленное значение
+    """
+    second = int(time.time())
+    cached = _user_time_cache.get(timezone_str)
+    if cached is not None and cached[0] == second:
+        return cached[1]
+    
     try:
-        tz = pytz.timezone(timezone_str)
-        return datetime.now(tz)
+        tz = get_zoneinfo(timezone_str)
+        user_time = datetime.now(tz)
     except Exception:
-        return datetime.now(pytz.UTC)
+        return datetime.now(get_zoneinfo("UTC"))
+    
+    _user_time_cache[timezone_str] = (second, user_time)
+    return user_time
 
 def convert_user_time_to_scheduler_timezone(
     user_datetime: datetime, 
@@ -64,13 +200,17 @@ def convert_user_time_to_scheduler_timezone(
     try:
         if scheduler_timezone is None:
             scheduler_timezone = get_scheduler_timezone()
+        
+        # Одинаковые часовые пояса - конвертировать нечего
+        if user_timezone == scheduler_timezone:
+            return user_datetime
             
         # Получаем объекты часовых поясов
-        user_tz = pytz.timezone(user_timezone)
-        scheduler_tz = pytz.timezone(scheduler_timezone)
+        user_tz = get_zoneinfo(user_timezone)
+        scheduler_tz = get_zoneinfo(scheduler_timezone)
         
-        # Локализуем время пользователя (делаем aware)
-        user_aware_time = user_tz.localize(user_datetime)
+        # Привязываем время пользователя к его часовому поясу (делаем aware)
+        user_aware_time = user_datetime.replace(tzinfo=user_tz)
         
         # Конвертируем в часовой пояс планировщика
         scheduler_time = user_aware_time.astimezone(scheduler_tz)
@@ -79,7 +219,7 @@ def convert_user_time_to_scheduler_timezone(
         return scheduler_time.replace(tzinfo=None)
         
     except Exception as e:
-        print(f"Error converting timezone from {user_timezone} to {scheduler_timezone}: {e}")
+        logger.error("Error converting timezone from %s to %s: %s", user_timezone, scheduler_timezone, e)
         # В случае ошибки возвращаем исходное время
         return user_datetime
 
@@ -102,13 +242,17 @@ def convert_scheduler_time_to_user_timezone(
     try:
         if scheduler_timezone is None:
             scheduler_timezone = get_scheduler_timezone()
+        
+        # Одинаковые часовые пояса - конвертировать нечего
+        if scheduler_timezone == user_timezone:
+            return scheduler_datetime
             
         # Получаем объекты часовых поясов
-        scheduler_tz = pytz.timezone(scheduler_timezone)
-        user_tz = pytz.timezone(user_timezone)
+        scheduler_tz = get_zoneinfo(scheduler_timezone)
+        user_tz = get_zoneinfo(user_timezone)
         
-        # Локализуем время планировщика (делаем aware)
-        scheduler_aware_time = scheduler_tz.localize(scheduler_datetime)
+        # Привязываем время планировщика к его часовому поясу (делаем aware)
+        scheduler_aware_time = scheduler_datetime.replace(tzinfo=scheduler_tz)
         
         # Конвертируем в часовой пояс пользователя
         user_time = scheduler_aware_time.astimezone(user_tz)
@@ -117,21 +261,31 @@ def convert_scheduler_time_to_user_timezone(
         return user_time.replace(tzinfo=None)
         
     except Exception as e:
-        print(f"Error converting timezone from {scheduler_timezone} to {user_timezone}: {e}")
+        logger.error("Error converting timezone from %s to %s: %s", scheduler_timezone, user_timezone, e)
         # В случае ошибки возвращаем исходное время
         return scheduler_datetime
 
+@lru_cache(maxsize=1)
 def get_scheduler_timezone() -> str:
     """
     Возвращает часовой пояс планировщика
-    Можно настроить через переменную окружения или конфиг
+    Можно настроить через переменную окружения или конфиг (читается один раз)
     """
     return os.getenv('SCHEDULER_TIMEZONE', 'UTC')
 
+@lru_cache(maxsize=256)
+def _get_timezone_offset_hours_cached(timezone_str: str, hour_bucket: int) -> int:
+    """Смещение часового пояса в часах; hour_bucket - номер текущего часа, делает кэш почасовым"""
+    now = datetime.now(get_zoneinfo(timezone_str))
+    return int(now.utcoffset().total_seconds() / 3600)
+
 def get_timezone_offset_hours(timezone_str: str) -> int:
     """
     Получает смещение часового пояса в часах относительно UTC
     
+    Смещение меняется только при переходе на летнее/зимнее время,
+    поэтому результат кэшируется в пределах текущего часа
+    
     Args:
         timezone_str: строка часового пояса (например, 'Europe/Moscow')
     
@@ -139,12 +293,15 @@ def get_timezone_offset_hours(timezone_str: str) -> int:
         int: смещение в часах (например, +3 для Москвы)
     """
     try:
-        tz = pytz.timezone(timezone_str)
-        now = datetime.now(tz)
-        return int(now.utcoffset().total_seconds() / 3600)
+        return _get_timezone_offset_hours_cached(timezone_str, int(time.time()) // 3600)
     except Exception:
         return 0
 
+@lru_cache(maxsize=1)
+def _get_available_timezones() -> frozenset:
+    """Имена всех известных часовых поясов (база tzdata читается один раз, при первой проверке)"""
+    return frozenset(available_timezones())
+
 def is_valid_timezone(timezone_str: str) -> bool:
     """
     Проверяет, является ли строка валидным часовым поясом
@@ -155,11 +312,43 @@ def is_valid_timezone(timezone_str: str) -> bool:
     Returns:
         bool: True если валидный, False если нет
     """
-    try:
-        pytz.timezone(timezone_str)
-        return True
-    except pytz.exceptions.UnknownTimeZoneError:
-        return False
+    return timezone_str in _get_available_timezones()
+
+# Названия городов для популярных часовых поясов
+TIMEZONE_CITY_NAMES = {
+    'Europe/Moscow': 'Москва',
+    'Europe/Kiev': 'Киев', 
+    'Asia/Almaty': 'Алматы',
+    'Europe/London': 'Лондон',
+    'Europe/Berlin': 'Берлин',
+    'America/New_York': 'Нью-Йорк',
+    'America/Los_Angeles': 'Лос-Анджелес',
+    'Asia/Tokyo': 'Токио',
+    'Australia/Sydney': 'Сидней',
+    'UTC': 'UTC'
+}
+
+def _format_timezone_label(city_name: str, offset: int) -> str:
+    """Подпись часового пояса вида 'Москва (UTC+3)'"""
+    offset_str = f"UTC{offset:+d}" if offset != 0 else "UTC"
+    return f"{city_name} ({offset_str})"
+
+def _build_timezone_labels() -> dict:
+    """
+    Заранее собирает подписи популярных часовых поясов: {пояс: {смещение: подпись}}
+    
+    Смещения берутся в январе и июле, чтобы покрыть и зимнее, и летнее время
+    """
+    labels = {}
+    for timezone_str, city_name in TIMEZONE_CITY_NAMES.items():
+        tz = get_zoneinfo(timezone_str)
+        labels[timezone_str] = {}
+        for month in (1, 7):
+            offset = int(datetime(2024, month, 15, tzinfo=tz).utcoffset().total_seconds() / 3600)
+            labels[timezone_str][offset] = _format_timezone_label(city_name, offset)
+    return labels
+
+_TIMEZONE_LABELS = _build_timezone_labels()
 
 def format_timezone_name(timezone_str: str) -> str:
     """
@@ -171,25 +360,15 @@ def format_timezone_name(timezone_str: str) -> str:
     Returns:
         str: отформатированное название (например, 'Москва (UTC+3)')
     """
-    timezone_names = {
-        'Europe/Moscow': 'Москва',
-        'Europe/Kiev': 'Киев', 
-        'Asia/Almaty': 'Алматы',
-        'Europe/London': 'Лондон',
-        'Europe/Berlin': 'Берлин',
-        'America/New_York': 'Нью-Йорк',
-        'America/Los_Angeles': 'Лос-Анджелес',
-        'Asia/Tokyo': 'Токио',
-        'Australia/Sydney': 'Сидней',
-        'UTC': 'UTC'
-    }
-    
     try:
         offset = get_timezone_offset_hours(timezone_str)
-        offset_str = f"UTC{offset:+d}" if offset != 0 else "UTC"
         
-        city_name = timezone_names.get(timezone_str, timezone_str.split('/')[-1])
-        return f"{city_name} ({offset_str})"
+        label = _TIMEZONE_LABELS.get(timezone_str, {}).get(offset)
+        if label is not None:
+            return label
+        
+        city_name = TIMEZONE_CITY_NAMES.get(timezone_str, timezone_str.split('/')[-1])
+        return _format_timezone_label(city_name, offset)
         
     except Exception:
         return timezone_str